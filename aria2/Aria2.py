@@ -3,6 +3,7 @@ import os
 import random
 import socket
 import subprocess
+import threading
 import time
 from urllib.parse import urlparse
 
@@ -60,8 +61,7 @@ class Aria2:
             if not self.is_portinuse(port):
                 return port
 
-    def start_downloading(self, url, output, header, progress):
-
+    def _add_download(self, url, output, header, options=None):
         filename = self.extract_url_filename(url)
         aria2_client = Client(
             host="http://localhost",
@@ -69,10 +69,25 @@ class Aria2:
         )
         aria2 = API(aria2_client)
 
-        downloader = aria2.add_uris([url], options={"dir": output, "out": filename, "header": header, "split": "8"})
-        self._update_progress(downloader.gid, progress, output)
+        downloader = aria2.add_uris([url], options={"dir": output, "out": filename, "header": header, "split": "8",
+                                                    **(options or {})})
         return downloader.gid
 
+    def start_downloading(self, url, output, header, progress):
+
+        gid = self._add_download(url, output, header)
+        self._update_progress(gid, progress, output)
+        return gid
+
+    def start_streaming(self, url, output, header, progress):
+        """
+        按文件顺序下载分片，立即返回可边下载边读取的 SequentialReader，进度在后台线程更新。
+        """
+        gid = self._add_download(url, output, header, {"stream-piece-selector": "inorder"})
+        updater = threading.Thread(target=self._update_progress, args=(gid, progress, output), daemon=True)
+        updater.start()
+        return SequentialReader(self, gid, updater)
+
     def _update_progress(self, gid, progress, temp):
         while True:
             status = self.get_status(gid)
@@ -119,6 +134,70 @@ class Aria2:
             "total_length": total_length,
             "completed_length": completed_length,
             "files": file_paths,
-            "dir": result["result"]["files"][0]["path"]
+            "dir": result["result"]["files"][0]["path"],
+            "bitfield": result["result"].get("bitfield", ""),
+            "piece_length": int(result["result"].get("pieceLength", 0))
         }
         return status
+
+
+class SequentialReader:
+    """
+    按顺序读出已下载完成的连续前缀，未下载到的部分轮询等待。
+    配合 inorder 分片选择，下载中的视频可以直接交给 ffmpeg 解码。
+    """
+
+    def __init__(self, aria2, gid, updater, block_size=1024 * 1024):
+        self.aria2 = aria2
+        self.gid = gid
+        self.updater = updater
+        self.block_size = block_size
+        self.offset = 0
+        self.total = 0
+
+    @property
+    def fraction(self):
+        return self.offset / self.total if self.total else 0.0
+
+    @staticmethod
+    def _completed_prefix(status, total):
+        """
+        bitfield 是十六进制的分片位图（高位在前），统计从头开始连续完成的分片。
+        """
+        if status["status"] == "complete":
+            return total
+        bits = "".join(f"{int(c, 16):04b}" for c in status["bitfield"])
+        pieces = len(bits) - len(bits.lstrip("1"))
+        return min(total, pieces * status["piece_length"])
+
+    def __iter__(self):
+        f = None
+        try:
+            while True:
+                status = self.aria2.get_status(self.gid)
+                if status["status"] in ("error", "removed"):
+                    raise RuntimeError(f"Download {self.gid} {status['status']}")
+                self.total = int(status["total_length"])
+
+                ready = self._completed_prefix(status, self.total)
+                if ready > self.offset and f is None:
+                    f = open(status["dir"], "rb")
+                while self.offset < ready:
+                    f.seek(self.offset)
+                    data = f.read(min(self.block_size, ready - self.offset))
+                    self.offset += len(data)
+                    yield data
+
+                if status["status"] == "complete":
+                    return
+                time.sleep(0.1)
+        finally:
+            if f is not None:
+                f.close()
+
+    def wait(self):
+        """
+        等待下载完成，返回视频文件路径。
+        """
+        self.updater.join()
+        return self.aria2.get_status(self.gid)["dir"]
@@ -1,3 +1,4 @@
+import ast
 import re
 
 from tool.api_request import ApiRequest
@@ -5,15 +6,19 @@ from tool.api_request import ApiRequest
 
 class BiliBiliDownloader:
 
-    def __init__(self, url, aria2, setting):
+    def __init__(self, url, aria2, setting, cid=None):
+        """
+        :param cid: 要下载的分P，默认第一个
+        """
         self.url = url
         self.setting = setting
         self.aria2 = aria2
+        self.cid = cid
         self.init_downloader()
         self._api_request = ApiRequest(self.setting)
 
     def get_video_address(self):
-        cid = self.get_cid()
+        cid = self.cid or self.get_cid()
         params = {
             "bvid": self.vid,
             "cid": cid,
@@ -23,25 +28,58 @@ class BiliBiliDownloader:
         response = self._api_request.get_response("GET", "https://api.bilibili.com/x/player/wbi/playurl?", params)
         return response["data"]["durl"][0]["url"]
 
-    def get_cid(self):
+    def get_video_info(self):
         params = {
             "bvid": self.vid
         }
 
         response = self._api_request.get_response("GET", "https://api.bilibili.com/x/web-interface/view?", params)
-        return response["data"]["cid"]
+        return response["data"]
+
+    def get_cid(self):
+        return self.get_video_info()["cid"]
+
+    def get_manifest(self):
+        """
+        读出上传时写在简介里的清单，并附上各分P的 cid；不是本程序上传的视频返回 {}。
+
+        :return: {"id", "mode", "cids"}，分片上传时还有 "shards"（分片数）和 "size"（原文件大小）
+        """
+        info = self.get_video_info()
+        try:
+            manifest = ast.literal_eval(info.get("desc", ""))
+        except (ValueError, SyntaxError):
+            return {}
+        if not isinstance(manifest, dict):
+            return {}
+        manifest["cids"] = [page["cid"] for page in info.get("pages", [])]
+        return manifest
 
     def init_downloader(self):
         self.vid = re.findall("https://www.bilibili.com/video/(.*?)/", self.url)[0]
 
-    def start_download(self, output, progress):
-
-        video_url = self.get_video_address()
-        header = [
+    def _headers(self):
+        return [
             "User-Agent: Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
             "Referer: https://www.bilibili.com/"
         ]
-        self.gid = self.aria2.startDownloading(video_url, output, header, progress)
+
+    def start_download(self, output, progress):
+        """
+        下载完成后返回视频文件路径。
+        """
+        video_url = self.get_video_address()
+        self.gid = self.aria2.start_downloading(video_url, output, self._headers(), progress)
+        return self.get_status()["dir"]
+
+    def start_stream(self, output, progress):
+        """
+        开始顺序下载，返回边下载边读取的 SequentialReader。
+        """
+        video_url = self.get_video_address()
+        reader = self.aria2.start_streaming(video_url, output, self._headers(), progress)
+        self.gid = reader.gid
+        return reader
 
     def get_status(self):
-        return self.aria2.getStatus(self.gid)
+        return self.aria2.get_status(self.gid)
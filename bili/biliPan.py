@@ -1,19 +1,27 @@
 import json
 import os
 import random
+import shutil
 import string
+import subprocess
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 from aria2 import Aria2
 from coder import decode, encode
+from coder.pool import CoderPool
 from tool.api_request import ApiRequest
-from tool.progress_json import init_progress_json
+from tool.growing_file import GrowingFile
+from tool.progress_json import init_progress_json, read_progress_json, write_progress_json
 from .biliDown import BiliBiliDownloader
 from .biliLogin import BiliBiliLogin
 from .biliUp import BiliUploader
 from .web_singer import WbiSigner
 
+# 分片长度留出的余量：纠删码的长度前缀和末块补齐、视频大小的估算误差
+SHARD_MARGIN = 0.95
+
 
 class BiliPan:
     def __init__(self, setting):
@@ -22,6 +30,9 @@ class BiliPan:
         self.api_request = ApiRequest(self.setting)
         self.wbi_signer = WbiSigner()
         self.aria2 = Aria2.Aria2(setting)
+        # 所有上传/下载任务共享的常驻编解码进程池，首次提交任务时才启动工作进程
+        pool_setting = self.setting.read_pool_setting()
+        self.coder_pool = CoderPool(pool_setting["processes"], pool_setting["batch_size"])
 
         self.uploaders = []
         self.downloaders = []
@@ -62,10 +73,17 @@ class BiliPan:
 
         return temp_path
 
-    def _init_task(self, file_path, mode):
-        task_id = self._create_task_id()
+    def _init_task(self, file_path, mode, task_id=None, **params):
+        """
+        :param task_id: 已有任务 id，沿用其临时目录和 progress.json，从中断处继续
+        :param params: 重启后恢复任务所需的其余参数，与 file_path 一起记入 progress.json
+        """
+        task_id = task_id or self._create_task_id()
         temp_path = self._ensure_temp_directory(task_id, mode)
         progress = init_progress_json(temp_path, "u" if mode == "upload" else "d")
+        # 续传时保留之前记下的内容（如分片方案）
+        progress["task"] = {**progress.get("task", {}), "file": file_path, **params}
+        write_progress_json(temp_path, progress)
 
         task_info = {
             "id": task_id,
@@ -81,37 +99,142 @@ class BiliPan:
 
         return task_id
 
-    def _handle_upload(self, task_id, file_path, mode):
-        task_info = next((u for u in self.uploaders if u["id"] == task_id), None)
-        if not task_info:
-            return
+    def _encode_video(self, encoder, video):
+        try:
+            encoder.execute()
+        except Exception as e:
+            video.fail(e)
+            raise
+        video.finish()
 
-        temp_path = task_info["temp"]
-        progress = task_info["progress"]
+    def _upload_video(self, task_id, file_path, mode, temp_path, progress, file_range=None, submit=True):
+        """
+        编码并上传一个视频，返回其 BiliUploader。
 
+        :param file_range: 只编码文件中的 (偏移, 长度) 这一段
+        :param submit: 为 False 时只上传视频文件不投稿，用于分片上传的各分P
+        """
         encoder = encode.QRender(
             task_id,
             file_path,
             temp_path,
             self.setting,
             progress,
-            mode
+            mode,
+            self.coder_pool,
+            file_range
         )
-        encoder.execute()
         video_path = encoder.result_path()
+        video = None
+        encode_thread = None
+        # 视频已合成过就直接复用，只补传未完成的阶段
+        if not (progress["encode"][1]["is_composite_video"] and os.path.exists(video_path)):
+            # 重新编码出的视频与之前上传的分块不一定相同，上传会话从头开始
+            progress["upload"][2]["is_init_upload_session"] = False
+            progress["upload"][3] = {"is_upload_chunks": False, "completed_chucks_bitmap": "", "etags": {}}
+            # 中断前写了一半的视频要先删掉：否则上传线程会立刻开始读这份旧文件，
+            # 等压缩、纠删编码做完 ffmpeg 截断它时，正在映射读取的分块会触发 SIGBUS
+            if os.path.exists(video_path):
+                os.remove(video_path)
+            if self.setting.read_upload_setting()["pipelined"] and self.setting.read_encoder_setting()["fragmented"]:
+                # 分片 MP4 只追加写入，编码的同时上传已写出的分块
+                video = GrowingFile(video_path)
+                encode_thread = threading.Thread(target=self._encode_video, args=(encoder, video))
+                encode_thread.start()
+            else:
+                encoder.execute()
 
-        uploader = BiliUploader(
-            video_path,
-            temp_path,
-            progress,
-            mode,
-            self.cookie_info,
-            self.setting
-        )
-        uploader.upload_video()
+        try:
+            uploader = BiliUploader(
+                video_path,
+                temp_path,
+                progress,
+                mode,
+                self.cookie_info,
+                self.setting,
+                video
+            )
+            if submit:
+                uploader.upload_video()
+            else:
+                uploader.upload_stream()
+        finally:
+            if encode_thread is not None:
+                encode_thread.join()
+        return uploader
+
+    def _shard_length(self):
+        """
+        单个视频最多能编码的输入字节数，0 表示不限。
+        平台对单个视频的时长和文件大小都有上限：时长按帧率和每帧负载换算，
+        文件大小按视频与负载之比 video_expansion 估算；纠删码的校验帧按比例扣除，压缩只会让视频更短，不计入。
+        """
+        upload = self.setting.read_upload_setting()
+        encoder = self.setting.read_encoder_setting()
+        limits = []
+        if upload["max_duration"]:
+            limits.append(upload["max_duration"] * encoder["fps"] * encode.frame_payload(encoder))
+        if upload["max_video_size"]:
+            limits.append(upload["max_video_size"] / upload["video_expansion"])
+        if not limits:
+            return 0
 
-    def upload_file(self, file_path, mode="normal"):
-        task_id = self._init_task(file_path, "upload")
+        fec = encoder["fec"]
+        data_ratio = fec["data"] / (fec["data"] + fec["parity"]) if fec["parity"] else 1
+        return int(min(limits) * data_ratio * SHARD_MARGIN)
+
+    def _plan_shards(self, file_path):
+        """
+        超过单个视频上限的输入切成若干 (偏移, 长度)，不需要分片时返回空列表。
+        """
+        shard_size = self._shard_length()
+        size = os.path.getsize(file_path)
+        if not shard_size or size <= shard_size:
+            return []
+        return [(offset, min(shard_size, size - offset)) for offset in range(0, size, shard_size)]
+
+    def _upload_shards(self, task_id, file_path, mode, temp_path, progress, shards):
+        """
+        各分片在 temp/<任务>/shards/<序号> 下各自编码、上传（带各自的 progress.json，可分别续传），
+        同时处理 shard_parallel 个；全部传完后作为同一稿件的多个分P一次投稿。
+        简介里的清单记录分片数和原文件大小，下载端据此并行下载各分P再按顺序拼接。
+        """
+        def upload_shard(index):
+            shard_temp = self._ensure_temp_directory(os.path.join(task_id, "shards", str(index)), "upload")
+            shard_progress = init_progress_json(shard_temp, "u")
+            return self._upload_video(f"{task_id}-{index}", file_path, mode, shard_temp, shard_progress,
+                                      shards[index], submit=False)
+
+        with ThreadPoolExecutor(self.setting.read_upload_setting()["shard_parallel"]) as executor:
+            parts = list(executor.map(upload_shard, range(len(shards))))
+
+        if not parts[0].progress["upload"][5]["is_submit_video"]:
+            size = sum(length for _, length in shards)
+            parts[0].upload_video(parts, {"shards": len(shards), "size": size})
+        progress["upload"][5]["is_submit_video"] = True
+        write_progress_json(temp_path, progress)
+
+    def _handle_upload(self, task_id, file_path, mode):
+        task_info = next((u for u in self.uploaders if u["id"] == task_id), None)
+        if not task_info:
+            return
+
+        temp_path = task_info["temp"]
+        progress = task_info["progress"]
+
+        task = progress["task"]
+        if "shards" not in task:
+            # 分片方案第一次执行时定下并保存，续传时沿用，不再依赖源文件
+            task["shards"] = self._plan_shards(file_path) if os.path.exists(file_path) else []
+            write_progress_json(temp_path, progress)
+        shards = [tuple(shard) for shard in task["shards"]]
+        if shards:
+            self._upload_shards(task_id, file_path, mode, temp_path, progress, shards)
+        else:
+            self._upload_video(task_id, file_path, mode, temp_path, progress)
+
+    def upload_file(self, file_path, mode="normal", task_id=None):
+        task_id = self._init_task(file_path, "upload", task_id, upload_mode=mode)
         upload_thread = threading.Thread(
             target=self._handle_upload,
             args=(task_id, file_path, mode)
@@ -119,16 +242,30 @@ class BiliPan:
         upload_thread.start()
         return task_id
 
-    def _handle_download(self, task_id, url, out_path, file_name):
-        task_info = next((d for d in self.downloaders if d["id"] == task_id), None)
-        if not task_info:
+    def _download_video(self, downloader, task_id, out_path, file_name, temp_path, progress):
+        """
+        下载并解码一个视频（分P），各阶段从 progress 记录的中断处继续。
+        """
+        if progress["decode"][1]["is_wirte_file"]:
+            return
+        if progress["decode"][0]["is_decode"]:
+            # 帧已全部解完，只差写出文件，不需要视频
+            decode.QRDecoder(task_id, None, out_path, file_name, temp_path, progress, self.setting,
+                             self.coder_pool).execute()
             return
 
-        temp_path = task_info["temp"]
-        progress = task_info["progress"]
-
-        downloader = BiliBiliDownloader(url, self.aria2, self.setting)
-        download_dir = downloader.start_download(temp_path, progress)
+        if self.setting.read_decoder_setting()["pipelined"]:
+            # 边下载边解码，总耗时接近 max(下载, 解码)
+            reader = downloader.start_stream(temp_path, progress)
+            try:
+                decode.QRDecoder(task_id, None, out_path, file_name, temp_path, progress, self.setting,
+                                 self.coder_pool, feed=reader).execute()
+                return
+            except subprocess.CalledProcessError:
+                # 容器不支持管道输入（如 moov 在文件末尾的 MP4），等下载完成后按文件解码
+                download_dir = reader.wait()
+        else:
+            download_dir = downloader.start_download(temp_path, progress)
 
         if download_dir:
             decoder = decode.QRDecoder(
@@ -138,15 +275,124 @@ class BiliPan:
                 file_name,
                 temp_path,
                 progress,
-                self.setting
+                self.setting,
+                self.coder_pool
             )
             decoder.execute()
 
-    def download_file(self, video_url, out_path, file_name):
-        task_id = self._init_task(video_url, "download")
+    def _download_shards(self, task_id, url, out_path, file_name, temp_path, progress, manifest):
+        """
+        按清单并行下载、解码各分P（每个在 temp/<任务>/shards/<序号> 下，可分别续传），再按分P顺序拼接。
+        """
+        def download_shard(index):
+            shard_temp = self._ensure_temp_directory(os.path.join(task_id, "shards", str(index)), "download")
+            shard_progress = init_progress_json(shard_temp, "d")
+            downloader = BiliBiliDownloader(url, self.aria2, self.setting, manifest["cids"][index])
+            self._download_video(downloader, f"{task_id}-{index}", shard_temp, "shard.bin", shard_temp,
+                                 shard_progress)
+            return os.path.join(shard_temp, "shard.bin")
+
+        with ThreadPoolExecutor(self.setting.read_decoder_setting()["shard_parallel"]) as executor:
+            paths = list(executor.map(download_shard, range(manifest["shards"])))
+
+        out = os.path.join(out_path, file_name)
+        with open(out, "wb") as dst:
+            for path in paths:
+                with open(path, "rb") as src:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+        if os.path.getsize(out) != manifest["size"]:
+            raise RuntimeError(f"Stitched size {os.path.getsize(out)} does not match manifest size {manifest['size']}")
+
+        progress["decode"][1]["is_wirte_file"] = True
+        write_progress_json(temp_path, progress)
+        for path in paths:
+            os.remove(path)
+
+    def _handle_download(self, task_id, url, out_path, file_name):
+        task_info = next((d for d in self.downloaders if d["id"] == task_id), None)
+        if not task_info:
+            return
+
+        temp_path = task_info["temp"]
+        progress = task_info["progress"]
+
+        if progress["decode"][1]["is_wirte_file"]:
+            return
+        downloader = BiliBiliDownloader(url, self.aria2, self.setting)
+        # 已在解码的单个视频不必再查清单
+        manifest = {} if progress["decode"][0]["is_decode"] else downloader.get_manifest()
+        if manifest.get("shards", 1) > 1:
+            self._download_shards(task_id, url, out_path, file_name, temp_path, progress, manifest)
+        else:
+            self._download_video(downloader, task_id, out_path, file_name, temp_path, progress)
+
+    def download_file(self, video_url, out_path, file_name, task_id=None):
+        task_id = self._init_task(video_url, "download", task_id, out_path=out_path, file_name=file_name)
         download_thread = threading.Thread(
             target=self._handle_download,
             args=(task_id, video_url, out_path, file_name)
         )
         download_thread.start()
-        return task_id
\ No newline at end of file
+        return task_id
+
+    def _has_videos(self, task_id, progress):
+        """
+        源文件不在时，只有各个视频（分片任务的每个分P）都已合成完才能续传。
+        流式合成和边编码边上传时视频是边写边落盘的，中断后留下的 mp4 可能只有一半，以进度里的合成标记为准。
+        """
+        shards = progress["task"].get("shards")
+        if not shards:
+            return self._is_composed(os.path.join("temp", task_id), progress, f"{task_id}.mp4")
+        for index in range(len(shards)):
+            shard_temp = os.path.join("temp", task_id, "shards", str(index))
+            try:
+                shard_progress = read_progress_json(shard_temp)
+            except (OSError, ValueError):
+                return False
+            if not self._is_composed(shard_temp, shard_progress, f"{task_id}-{index}.mp4"):
+                return False
+        return True
+
+    @staticmethod
+    def _is_composed(temp_path, progress, video_name):
+        return progress["encode"][1]["is_composite_video"] and \
+            os.path.exists(os.path.join(temp_path, "output", video_name))
+
+    def resume_tasks(self):
+        """
+        扫描 temp/ 下未完成的任务，按 progress.json 记录的参数重新启动，各阶段从中断处继续。
+
+        :return: 恢复的任务 id 列表
+        """
+        resumed = []
+        if not os.path.isdir("temp"):
+            return resumed
+
+        for task_id in sorted(os.listdir("temp")):
+            temp_path = os.path.join("temp", task_id)
+            if not os.path.isfile(os.path.join(temp_path, "progress.json")):
+                continue
+            try:
+                progress = read_progress_json(temp_path)
+            except ValueError:
+                # 旧版本写到一半崩溃会留下不完整的 progress.json，跳过这个任务，不影响其它任务和启动
+                continue
+            task = progress.get("task")
+            if task is None:
+                continue
+
+            if "upload" in progress:
+                if progress["upload"][5]["is_submit_video"]:
+                    continue
+                if not os.path.exists(task["file"]) and not self._has_videos(task_id, progress):
+                    continue
+                self.upload_file(task["file"], task["upload_mode"], task_id)
+            else:
+                if progress["decode"][1]["is_wirte_file"]:
+                    continue
+                self.download_file(task["file"], task["out_path"], task["file_name"], task_id)
+            resumed.append(task_id)
+        return resumed
+
+    def close(self):
+        self.coder_pool.close()
@@ -1,31 +1,51 @@
 import base64
+import mmap
 import os
+import random
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from typing import Dict
 
 import cv2
+import requests
 
 from tool.api_request import ApiRequest
-from tool.progress_json import write_progress_json
+from tool.growing_file import GrowingFile
+from tool.progress_json import ProgressBitmap, write_progress_json
+
+
+# 分块上传时可重试的 HTTP 状态码：请求超时、限流和服务端错误；其它 4xx 重试也不会成功
+RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+# 单次退避的上限（秒）
+BACKOFF_MAX = 60
 
 
 class BiliUploader:
 
-    def __init__(self, video_path: str, temp: str, progress: Dict, mode: str, cookie_info: list, setting):
+    def __init__(self, video_path: str, temp: str, progress: Dict, mode: str, cookie_info: list, setting,
+                 video: GrowingFile = None):
+        """
+        :param video: 视频仍在编码时传入，分块写出一块就上传一块，文件大小在编码结束后才确定
+        """
         self.video_path = video_path
         self.temp = temp
         self.progress = progress
         self.mode = mode
         self.setting = setting
+        self.video = video
 
         self._init_video_metadata()
         self._api_request = ApiRequest(self.setting)
+        # 分块上传单独使用一个会话，连接池大小与并发数一致
+        self.upload_setting = self.setting.read_upload_setting()
+        self._upload_request = ApiRequest(self.setting)
+        self._upload_request.set_pool_size(self.upload_setting["concurrency"])
 
         self.bili_jct = cookie_info[self.setting.read_now_cookie()]["bili_jct"]
 
     def _init_video_metadata(self):
         self.video_name = os.path.basename(self.video_path)
-        self.file_size = os.path.getsize(self.video_path)
+        self.file_size = os.path.getsize(self.video_path) if self.video is None else self.video.size
 
     def get_video_types(self) -> str:
         data = {
@@ -49,11 +69,15 @@ class BiliUploader:
 
     def upload_cover(self) -> str:
 
-        params = {'ts': int(time.time() * 1000)}
         frame = cv2.imread("black_cover.png")
 
         _, img_buffer = cv2.imencode(".png", frame)
         self.cover_base64 = f"data:image/jpeg;base64,{base64.b64encode(img_buffer).decode('utf-8')}"
+        if self.progress["upload"][0]["is_upload_cover"]:
+            self.cover_url = self.progress["upload"][0]["cover_url"]
+            return self.cover_url
+
+        params = {'ts': int(time.time() * 1000)}
 
         data = {
             'csrf': self.bili_jct,
@@ -67,12 +91,16 @@ class BiliUploader:
             data=data,
         )
         self.cover_url = response.get('data', {}).get('url', '')
+        self.progress["upload"][0]["cover_url"] = self.cover_url
         self.progress["upload"][0]["is_upload_cover"] = True
         write_progress_json(self.temp, self.progress)
 
         return response.get('data', {}).get('url', '')
 
     def preupload_video(self):
+        if self.progress["upload"][1]["is_preupload_video"]:
+            self.upload_meta = self.progress["upload"][1]["upload_meta"]
+            return self.upload_meta
 
         params = {
             'name': self.video_name,
@@ -93,11 +121,16 @@ class BiliUploader:
             'upos_uri': response.get('upos_uri', ''),
             'biz_id': response.get('biz_id', '')
         }
+        self.progress["upload"][1]["upload_meta"] = self.upload_meta
         self.progress["upload"][1]["is_preupload_video"] = True
         write_progress_json(self.temp, self.progress)
         return self.upload_meta
 
     def init_upload_session(self) -> str:
+        if self.progress["upload"][2]["is_init_upload_session"]:
+            self.upload_id = self.progress["upload"][2]["upload_id"]
+            return self.upload_id
+
         url = f"https:{self.upload_meta['endpoint']}/{self.upload_meta['upos_uri'].replace('upos://', '')}"
         params = {
             'uploads': '',
@@ -117,52 +150,162 @@ class BiliUploader:
         )
 
         self.upload_id = response.get('upload_id', '')
+        self.progress["upload"][2]["upload_id"] = self.upload_id
         self.progress["upload"][2]["is_init_upload_session"] = True
         write_progress_json(self.temp, self.progress)
         return self.upload_id
 
-    def upload_chunks(self):
-        """
-        分块上传视频。
-        """
-        chunk_size = self.upload_meta['chunk_size']
-        total_chunks = (self.file_size + chunk_size - 1) // chunk_size
-        url = f"https:{self.upload_meta['endpoint']}/{self.upload_meta['upos_uri'].replace('upos://', '')}"
+    def _upload_part(self, url, chunk_num, total_chunks, start, data):
+        # 边编码边上传时总块数和文件大小未知，值为 None 的参数不会发送
+        params = {
+            'partNumber': chunk_num + 1,
+            'uploadId': self.upload_id,
+            'chunk': chunk_num,
+            'chunks': total_chunks,
+            'size': len(data),
+            'start': start,
+            'end': start + len(data),
+            'total': self.file_size
+        }
+
+        headers = {
+            'X-Upos-Auth': self.upload_meta['auth'],
+            'Content-Type': 'application/octet-stream'
+        }
 
-        with open(self.video_path, 'rb') as f:
-            for chunk_num in range(total_chunks):
-                start = chunk_num * chunk_size
-                end = min(start + chunk_size, self.file_size)
-                f.seek(start)
-                data = f.read(end - start)
-
-                params = {
-                    'partNumber': chunk_num + 1,
-                    'uploadId': self.upload_id,
-                    'chunk': chunk_num,
-                    'chunks': total_chunks,
-                    'size': len(data),
-                    'start': start,
-                    'end': end,
-                    'total': self.file_size
-                }
-
-                headers = {
-                    'X-Upos-Auth': self.upload_meta['auth'],
-                    'Content-Type': 'application/octet-stream'
-                }
-
-                response = self._api_request.get_response(
+        retries = self.upload_setting["retries"]
+        for attempt in range(retries + 1):
+            try:
+                response = self._upload_request.get_response(
                     'PUT',
                     url,
                     params=params,
                     data=data,
-                    headers=headers
+                    headers=headers,
+                    raw=True,
+                    timeout=self.upload_setting["timeout"]
                 )
+                return chunk_num, response.headers.get('ETag', 'etag')
+            except requests.RequestException as e:
+                if attempt == retries or not self._is_transient(e):
+                    raise
+                time.sleep(self._backoff(attempt, e))
+
+    @staticmethod
+    def _is_transient(error):
+        """
+        连接失败和超时总是重试；HTTP 错误只重试 RETRY_STATUS 中的状态码。
+        """
+        if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+            return True
+        if isinstance(error, requests.HTTPError) and error.response is not None:
+            return error.response.status_code in RETRY_STATUS
+        return False
+
+    def _backoff(self, attempt, error):
+        """
+        带完全抖动的指数退避，并发的各块不会同时重试；服务端给出 Retry-After 时至少等待这么久。
+        """
+        delay = random.uniform(0, min(BACKOFF_MAX, self.upload_setting["backoff"] * 2 ** attempt))
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("Retry-After", "") if response is not None else ""
+        if retry_after.isdigit():
+            delay = max(delay, int(retry_after))
+        return delay
+
+    def _record_parts(self, done, completed, etags):
+        """
+        记下成功的块并保存进度，返回第一个失败块的异常。
+        """
+        error = None
+        for future in done:
+            if future.cancelled():
+                continue
+            if future.exception() is not None:
+                error = error or future.exception()
+                continue
+            chunk_num, etag = future.result()
+            completed.add(chunk_num)
+            etags[str(chunk_num + 1)] = etag
+        self.progress["upload"][3]["completed_chucks_bitmap"] = completed.dumps()
+        write_progress_json(self.temp, self.progress)
+        return error
+
+    @staticmethod
+    def _map_part(f, start, length):
+        """
+        把文件中的一块映射为只读 memoryview，发送时直接读页缓存，不为每块分配缓冲区。
+        映射的起点须对齐到 ALLOCATIONGRANULARITY；映射在最后一个引用（含 requests 保存的请求体）释放时关闭。
+        """
+        offset = start - start % mmap.ALLOCATIONGRANULARITY
+        region = mmap.mmap(f.fileno(), start + length - offset, access=mmap.ACCESS_READ, offset=offset)
+        return memoryview(region)[start - offset:]
+
+    def upload_chunks(self):
+        """
+        分块并发上传视频，同时在途的块数为 concurrency 的两倍，各块以文件映射的形式交给 requests。
+        视频仍在编码时，每等到写出完整的一块就提交，只有末块要等编码结束。
+        每传完一块记入 progress.json 的位图和 ETag，重启后只传剩下的块。
+        """
+        if self.progress["upload"][3]["is_upload_chunks"]:
+            return
+
+        chunk_size = self.upload_meta['chunk_size']
+        url = f"https:{self.upload_meta['endpoint']}/{self.upload_meta['upos_uri'].replace('upos://', '')}"
+        completed = ProgressBitmap.loads(self.progress["upload"][3].get("completed_chucks_bitmap", ""))
+        etags = self.progress["upload"][3].setdefault("etags", {})
+        concurrency = self.upload_setting["concurrency"]
+        if self.video is not None:
+            self.video.wait(0)
+
+        pending = set()
+        with open(self.video_path, 'rb') as f, ThreadPoolExecutor(concurrency) as executor:
+            try:
+                chunk_num = 0
+                while True:
+                    start = chunk_num * chunk_size
+                    if self.file_size is None:
+                        self.video.wait(start + chunk_size)
+                        self.file_size = self.video.size
+                    if self.file_size is not None and start >= self.file_size:
+                        break
+
+                    if chunk_num not in completed:
+                        done = {future for future in pending if future.done()}
+                        if len(pending) - len(done) >= concurrency * 2:
+                            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        if done:
+                            pending -= done
+                            error = self._record_parts(done, completed, etags)
+                            if error is not None:
+                                raise error
+
+                        if self.file_size is None:
+                            data = self._map_part(f, start, chunk_size)
+                            total_chunks = None
+                        else:
+                            data = self._map_part(f, start, min(chunk_size, self.file_size - start))
+                            total_chunks = (self.file_size + chunk_size - 1) // chunk_size
+                        pending.add(executor.submit(self._upload_part, url, chunk_num, total_chunks, start, data))
+                    chunk_num += 1
+            except BaseException:
+                # 不再提交新块，已在传的块传完后也记入进度，重启后只补传缺少的块
+                for future in pending:
+                    future.cancel()
+                wait(pending)
+                self._record_parts(pending, completed, etags)
+                raise
+
+            done, _ = wait(pending)
+            error = self._record_parts(done, completed, etags)
+            if error is not None:
+                raise error
         self.progress["upload"][3]["is_upload_chunks"] = True
         write_progress_json(self.temp, self.progress)
 
     def complete_upload(self):
+        if self.progress["upload"][4]["is_complete_upload"]:
+            return None
 
         total_chunks = (self.file_size + self.upload_meta['chunk_size'] - 1) // self.upload_meta['chunk_size']
         url = f"https:{self.upload_meta['endpoint']}/{self.upload_meta['upos_uri'].replace('upos://', '')}"
@@ -174,7 +317,8 @@ class BiliUploader:
             'biz_id': self.upload_meta['biz_id']
         }
 
-        parts = [{"partNumber": i + 1, "eTag": "etag"} for i in range(total_chunks)]
+        etags = self.progress["upload"][3].get("etags", {})
+        parts = [{"partNumber": i + 1, "eTag": etags.get(str(i + 1), "etag")} for i in range(total_chunks)]
 
         headers = {
             'X-Upos-Auth': self.upload_meta['auth'],
@@ -195,37 +339,49 @@ class BiliUploader:
 
         return response
 
-    def upload_video(self):
-        self.upload_cover()
+    def upload_stream(self):
+        """
+        上传视频文件本身（不投稿），分片上传时各分P分别调用。
+        """
         self.preupload_video()
         self.init_upload_session()
         self.upload_chunks()
         self.complete_upload()
 
+    def video_entry(self) -> Dict:
+        return {
+            "filename": self.upload_meta['upos_uri'].split('/')[-1].split(".")[0],
+            "title": os.path.basename(self.video_path),
+            "desc": "",
+            "cid": self.upload_meta['biz_id']
+        }
+
+    def upload_video(self, parts: list = None, manifest: Dict = None):
+        """
+        :param parts: 分片上传时已传完的各分P（BiliUploader），按顺序投稿到同一稿件；默认只有自身
+        :param manifest: 分片清单（分片数、原文件大小），写入简介供下载端并行下载后拼接
+        """
+        self.upload_cover()
+        if parts is None:
+            self.upload_stream()
+
         v_type = self.get_video_types()
         if self.mode == "info":
-            desc = str({"id": os.path.basename(self.video_path), "mode": "data"})
+            info = {"id": os.path.basename(self.video_path), "mode": "data"}
         else:
-            desc = str({"id": os.path.basename(self.video_path), "mode": "file"})
+            info = {"id": os.path.basename(self.video_path), "mode": "file"}
         metadata = {
-            "title": desc,
-            "desc": desc,
+            "title": str(info),
+            "desc": str({**info, **(manifest or {})}),
             "tag": "PixelCloud,像素网盘",
             "tid": v_type
         }
-        self.submit_video(metadata)
+        self.submit_video(metadata, parts)
 
-    def submit_video(self, metadata: Dict = None) -> Dict:
+    def submit_video(self, metadata: Dict = None, parts: list = None) -> Dict:
 
         submit_data = {
-            "videos": [
-                {
-                    "filename": self.upload_meta['upos_uri'].split('/')[-1].split(".")[0],
-                    "title": os.path.basename(self.video_path),
-                    "desc": "",
-                    "cid": self.upload_meta['biz_id']
-                }
-            ],
+            "videos": [part.video_entry() for part in parts or [self]],
             "cover": self.cover_url,
             "cover43": "",
             "title": metadata["title"],
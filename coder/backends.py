@@ -0,0 +1,197 @@
+import time
+from collections import namedtuple
+from functools import lru_cache
+
+import cv2
+import numpy as np
+import qrcode
+from qrcode.util import QRData, MODE_8BIT_BYTE
+
+try:
+    from pyzbar.pyzbar import decode as zbar_decode
+    from coder.zbar import decode_binary
+except ImportError:
+    zbar_decode = None
+
+try:
+    import zxingcpp
+except ImportError:
+    zxingcpp = None
+
+# 与 pyzbar 的 Rect 字段一致
+Rect = namedtuple("Rect", "left top width height")
+
+# 每个工作进程在前几帧上对所有后端计时，之后按有效负载数和耗时排序
+CALIBRATION_FRAMES = 3
+
+# 检查后端能否原样返回字节模式数据的样例负载，覆盖全部 256 个字节值
+PROBE_PAYLOAD = bytes(range(256))
+
+
+def _bounding_rect(points):
+    xs = [int(x) for x, _ in points]
+    ys = [int(y) for _, y in points]
+    return Rect(min(xs), min(ys), max(xs) - min(xs), max(ys) - min(ys))
+
+
+class ZbarBackend:
+    name = "zbar"
+
+    def __init__(self, payload_format):
+        self.binary = payload_format == "binary"
+
+    @staticmethod
+    def supports(payload_format):
+        return zbar_decode is not None
+
+    def scan(self, image):
+        symbols = decode_binary(image) if self.binary else zbar_decode(image)
+        return [(obj.data, obj.rect) for obj in symbols]
+
+
+class ZXingBackend:
+    name = "zxing"
+
+    def __init__(self, payload_format):
+        pass
+
+    @staticmethod
+    def supports(payload_format):
+        return zxingcpp is not None
+
+    def scan(self, image):
+        results = zxingcpp.read_barcodes(image, formats=zxingcpp.BarcodeFormat.QRCode)
+        symbols = []
+        for result in results:
+            if result.valid:
+                position = result.position
+                corners = (position.top_left, position.top_right, position.bottom_right, position.bottom_left)
+                symbols.append((result.bytes, _bounding_rect([(p.x, p.y) for p in corners])))
+        return symbols
+
+
+class OpenCVBackend:
+    name = "opencv"
+
+    def __init__(self, payload_format):
+        self.detector = cv2.QRCodeDetector()
+
+    @staticmethod
+    def supports(payload_format):
+        # 旧版 OpenCV 只返回 str，有的版本返回 bytes 但已转成 UTF-8，字节模式的数据都会被破坏
+        return payload_format != "binary" or _opencv_keeps_bytes()
+
+    def _decode_multi(self, image):
+        if hasattr(self.detector, "detectAndDecodeBytesMulti"):
+            ok, payloads, points, _ = self.detector.detectAndDecodeBytesMulti(image)
+        else:
+            ok, payloads, points, _ = self.detector.detectAndDecodeMulti(image)
+            payloads = [payload.encode() for payload in payloads]
+        return list(zip(payloads, points)) if ok else []
+
+    def _decode_single(self, image):
+        if hasattr(self.detector, "detectAndDecodeBytes"):
+            payload, points, _ = self.detector.detectAndDecodeBytes(image)
+        else:
+            payload, points, _ = self.detector.detectAndDecode(image)
+            payload = payload.encode()
+        return [(payload, points[0])] if payload else []
+
+    def scan(self, image):
+        # 多码检测在单码帧上偶尔失败，此时再按单码检测一次
+        found = self._decode_multi(image) or self._decode_single(image)
+        return [(payload, _bounding_rect(points)) for payload, points in found if payload]
+
+
+class WeChatBackend:
+    name = "wechat"
+
+    def __init__(self, payload_format):
+        self.detector = cv2.wechat_qrcode_WeChatQRCode()
+
+    @staticmethod
+    def supports(payload_format):
+        return payload_format != "binary" and hasattr(cv2, "wechat_qrcode_WeChatQRCode")
+
+    def scan(self, image):
+        texts, points = self.detector.detectAndDecode(image)
+        return [(text.encode(), _bounding_rect(corners)) for text, corners in zip(texts, points) if text]
+
+
+@lru_cache(maxsize=None)
+def _opencv_keeps_bytes():
+    """
+    识别一个已知的字节模式码，返回的负载与原样一致才算支持二进制负载；每个进程只检查一次。
+    """
+    if not hasattr(cv2.QRCodeDetector, "detectAndDecodeBytes"):
+        return False
+    qr = qrcode.QRCode(border=4)
+    qr.add_data(QRData(PROBE_PAYLOAD, mode=MODE_8BIT_BYTE, check_data=False))
+    qr.make(fit=True)
+    image = np.kron(np.where(qr.get_matrix(), 0, 255).astype(np.uint8), np.ones((4, 4), dtype=np.uint8))
+    payload, _, _ = cv2.QRCodeDetector().detectAndDecodeBytes(image)
+    return payload == PROBE_PAYLOAD
+
+
+BACKENDS = {backend.name: backend for backend in (ZXingBackend, ZbarBackend, OpenCVBackend, WeChatBackend)}
+
+
+class BackendSelector:
+    """
+    在已安装的识别库中选择后端。
+
+    识别到的码都先经 parse 校验（如检查帧头），只有返回值不为 None 的才算识别成功：
+    返回错误字节的后端识别到的码再多也不计数。
+    preferred 为 "auto" 时，前 CALIBRATION_FRAMES 次识别让所有后端都跑一遍并计时，
+    之后按（有效负载多、耗时少）排序；指定名称时该后端排在最前，不做校准。
+    每次识别按顺序尝试，有效负载达到期望数量即返回，否则换下一个后端。
+    """
+
+    def __init__(self, payload_format, preferred="auto", parse=lambda data: data):
+        self.parse = parse
+        self.backends = [backend(payload_format) for backend in BACKENDS.values() if backend.supports(payload_format)]
+        if not self.backends:
+            raise RuntimeError(f"No QR decoder backend available for payload format {payload_format!r}")
+
+        if preferred == "auto":
+            self.calibrating = CALIBRATION_FRAMES
+        else:
+            self.calibrating = 0
+            self.backends.sort(key=lambda backend: backend.name != preferred)
+        self.stats = {backend.name: [0, 0.0] for backend in self.backends}
+
+    def scan(self, image, expected=1):
+        """
+        :return: [(parse 的结果, 外接矩形)]，校验不通过的码已丢弃
+        """
+        if self.calibrating:
+            return self._calibrate(image)
+
+        best = []
+        for backend in self.backends:
+            symbols = self._scan(backend, image)
+            if len(symbols) >= expected:
+                return symbols
+            if len(symbols) > len(best):
+                best = symbols
+        return best
+
+    def _calibrate(self, image):
+        best = []
+        for backend in self.backends:
+            start = time.perf_counter()
+            symbols = self._scan(backend, image)
+            stat = self.stats[backend.name]
+            stat[0] += len(symbols)
+            stat[1] += time.perf_counter() - start
+            if len(symbols) > len(best):
+                best = symbols
+
+        self.calibrating -= 1
+        if not self.calibrating:
+            self.backends.sort(key=lambda backend: (-self.stats[backend.name][0], self.stats[backend.name][1]))
+        return best
+
+    def _scan(self, backend, image):
+        symbols = [(self.parse(data), rect) for data, rect in backend.scan(image)]
+        return [(value, rect) for value, rect in symbols if value is not None]
@@ -0,0 +1,109 @@
+import cv2
+import numpy as np
+
+try:
+    # reedsolo 的 Cython 版本，装了就用，纠错解码快一个数量级
+    from creedsolo import RSCodec, ReedSolomonError
+except ImportError:
+    from reedsolo import RSCodec, ReedSolomonError
+
+# 2 bit/块时的格雷码亮度顺序，相邻亮度只差 1 bit
+_GRAY_ORDER = {1: [0, 1], 2: [0, 1, 3, 2]}
+
+
+class BlockCodec:
+    """
+    高密度亮度块编码，作为 QR 码之外的纯数据通道。
+
+    帧由 rows x cols 个 block_size 像素的方块组成：最外一圈是黑白相间的校准边框，
+    解码时用它估计黑/白亮度；内部每块按亮度携带 bits_per_block（1 或 2）bit。
+    每帧数据为 4 字节长度头 + 负载，整体经 Reed-Solomon（每 255 字节 rs_nsym 个校验字节）保护。
+    编解码的像素部分都是 NumPy 数组运算。
+    """
+
+    def __init__(self, block_size, cols, rows, bits_per_block, rs_nsym):
+        self.block_size = block_size
+        self.cols = cols
+        self.rows = rows
+        self.bits = bits_per_block
+        self.levels = 2 ** bits_per_block
+        self.rs = RSCodec(rs_nsym)
+
+        self.capacity = (rows - 2) * (cols - 2) * self.bits // 8
+        full, rest = divmod(self.capacity, 255)
+        self.payload_size = full * (255 - rs_nsym) + max(0, rest - rs_nsym) - 4
+        self.encoded_size = full * 255 + (rest if rest > rs_nsym else 0)
+
+        gray = np.array(_GRAY_ORDER[self.bits], dtype=np.uint8)
+        self._symbol_to_level = gray
+        self._level_to_symbol = np.argsort(gray).astype(np.uint8)
+
+        ring = np.indices((rows, cols)).sum(axis=0) % 2
+        self._border = np.ones((rows, cols), dtype=bool)
+        self._border[1:-1, 1:-1] = False
+        self._border_white = self._border & (ring == 1)
+        self._border_black = self._border & (ring == 0)
+        self._blocks = np.where(ring == 1, 255, 0).astype(np.uint8)
+        self._buffer = np.empty((rows * block_size, cols * block_size), dtype=np.uint8)
+
+    def frame_size(self):
+        return self.cols * self.block_size, self.rows * self.block_size
+
+    def _to_symbols(self, data):
+        bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8))
+        bits = np.pad(bits, (0, (self.rows - 2) * (self.cols - 2) * self.bits - len(bits)))
+        weights = 1 << np.arange(self.bits - 1, -1, -1, dtype=np.uint8)
+        return (bits.reshape(-1, self.bits) * weights).sum(axis=1).astype(np.uint8)
+
+    def _from_symbols(self, symbols):
+        bits = (symbols[:, None] >> np.arange(self.bits - 1, -1, -1, dtype=np.uint8)) & 1
+        return np.packbits(bits.reshape(-1)).tobytes()[:self.capacity]
+
+    def encode(self, payload):
+        # 末帧补零到满长度，保证每帧 RS 码字长度一致
+        message = len(payload).to_bytes(4, "big") + bytes(payload)
+        message += bytes(self.payload_size + 4 - len(message))
+        codeword = bytes(self.rs.encode(message))
+
+        levels = self._symbol_to_level[self._to_symbols(codeword)]
+        step = 255 // (self.levels - 1)
+        self._blocks[1:-1, 1:-1] = (levels * step).reshape(self.rows - 2, self.cols - 2)
+
+        size = self.block_size
+        self._buffer.reshape(self.rows, size, self.cols, size)[...] = self._blocks[:, None, :, None]
+        return self._buffer
+
+    def decode(self, image):
+        """
+        成功时返回负载字节，校验失败返回 None。
+        """
+        if image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        width, height = self.frame_size()
+        if image.shape[:2] != (height, width):
+            image = cv2.resize(image[:height, :width], (width, height), interpolation=cv2.INTER_AREA)
+
+        # 只取每块中心区域求均值，避开压缩造成的边缘渗色
+        size = self.block_size
+        margin = size // 4
+        cells = image.reshape(self.rows, size, self.cols, size)
+        means = cells[:, margin:size - margin, :, margin:size - margin].mean(axis=(1, 3))
+
+        black = means[self._border_black].mean()
+        white = means[self._border_white].mean()
+        if white - black < 32:
+            return None
+
+        scaled = (means[1:-1, 1:-1] - black) * ((self.levels - 1) / (white - black))
+        levels = np.clip(np.rint(scaled), 0, self.levels - 1).astype(np.uint8).reshape(-1)
+        codeword = self._from_symbols(self._level_to_symbol[levels])
+
+        try:
+            message = self.rs.decode(bytearray(codeword[:self.encoded_size]))[0]
+        except ReedSolomonError:
+            return None
+
+        length = int.from_bytes(message[:4], "big")
+        if length > self.payload_size:
+            return None
+        return bytes(message[4:4 + length])
@@ -0,0 +1,95 @@
+import lzma
+import os
+import zlib
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# 压缩容器：MAGIC + 方法号(1 字节)，随后是若干 [长度(4 字节) + 独立压缩的数据块]
+MAGIC = b"\x89PXC\r\n\x1a\n"
+METHODS = {"zlib": 1, "lzma": 2, "zstd": 3}
+METHOD_NAMES = {v: k for k, v in METHODS.items()}
+
+# 采样字节熵（bit/字节）高于该值视为已压缩/加密数据，直接跳过
+ENTROPY_LIMIT = 7.5
+
+
+def probe_entropy(path, offset=0, length=None, samples=16, sample_size=64 * 1024):
+    """
+    在文件的 [offset, offset + length) 中均匀取若干片段估算字节熵，默认整个文件。
+    """
+    if length is None:
+        length = os.path.getsize(path) - offset
+    if length == 0:
+        return 0.0
+
+    counts = np.zeros(256, dtype=np.int64)
+    step = max(length // samples, sample_size)
+    with open(path, 'rb') as f:
+        for start in range(0, length, step):
+            f.seek(offset + start)
+            sample = f.read(min(sample_size, length - start))
+            counts += np.bincount(np.frombuffer(sample, dtype=np.uint8), minlength=256)
+
+    p = counts[counts > 0] / counts.sum()
+    return float(-(p * np.log2(p)).sum())
+
+
+def choose_method(path, setting, offset=0, length=None):
+    """
+    :param setting: "auto"、"none" 或具体方法名；auto 时优先 zstd，未安装则用 zlib
+    :param offset: 只看文件中从 offset 开始的 length 字节
+    :return: 方法名，不压缩时返回 None
+    """
+    if setting == "none":
+        return None
+    if probe_entropy(path, offset, length) > ENTROPY_LIMIT:
+        return None
+    if setting == "auto":
+        return "zstd" if zstandard is not None else "zlib"
+    if setting == "zstd" and zstandard is None:
+        return "zlib"
+    return setting
+
+
+def compress_block(method, data):
+    if method == "zstd":
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    if method == "lzma":
+        return lzma.compress(data, preset=6)
+    return zlib.compress(data, 9)
+
+
+def decompress_block(method, data):
+    if method == "zstd":
+        return zstandard.ZstdDecompressor().decompress(data)
+    if method == "lzma":
+        return lzma.decompress(data)
+    return zlib.decompress(data)
+
+
+def write_header(f, method):
+    f.write(MAGIC + bytes([METHODS[method]]))
+
+
+def write_block(f, block):
+    f.write(len(block).to_bytes(4, "big") + block)
+
+
+def decompress_stream(src, dst):
+    """
+    从 src 读取压缩容器，逐块解压写入 dst。是否压缩由流参数给出，这里只核对容器头。
+    """
+    head = src.read(len(MAGIC) + 1)
+    if head[:len(MAGIC)] != MAGIC or head[-1] not in METHOD_NAMES:
+        raise ValueError("Stream is not a compressed container")
+    method = METHOD_NAMES[head[-1]]
+    while True:
+        length = src.read(4)
+        if not length:
+            break
+        dst.write(decompress_block(method, src.read(int.from_bytes(length, "big"))))
@@ -1,28 +1,113 @@
 import base64
+import binascii
+import bisect
 import os
 import shutil
 import subprocess
+import threading
 import time
-from multiprocessing import Process, Queue, Manager, Value
-from queue import Empty
+from fractions import Fraction
+from multiprocessing import shared_memory
 
 import cv2
+import numpy as np
 from natsort import natsorted
-from pyzbar.pyzbar import decode
 
-from tool.progress_json import write_progress_json
+from coder import compress, header
+from coder.backends import BackendSelector
+from coder.block import BlockCodec
+from coder.fec import FrameFEC
+from coder.pool import CoderPool, cached
+from coder.whiten import whiten
+from coder.writer import ChunkWriter
+from tool.progress_json import ProgressBitmap, write_progress_json
+
+
+def _decode_batch(decoder, batch):
+    return decoder._decode_batch(batch)
+
+
+def _decode_ring_batch(decoder, batch):
+    return decoder._decode_ring_batch(batch)
+
+
+def _decode_segment_batch(decoder, batch):
+    return [decoder._decode_segment(segment) for segment in batch]
+
+
+# 重复帧判定用的缩略图尺寸：每格约 12x12 像素，哪怕只有帧头几个字节不同也能拉开差距
+DEDUPE_SIZE = (160, 90)
+
+# 快速路径把模块缩放到约 3 像素，zbar 在这个尺度上识别稳定且像素最少
+MODULE_PIXELS = 3
+
+# ffmpeg 输出灰度 yuv4mpeg 流：流头自带宽高，管道输入时也无需预先探测
+Y4M_OUTPUT = ["-f", "yuv4mpegpipe", "-pix_fmt", "gray", "-"]
+
+# 判断是否为没有帧头的旧视频时，最多解码开头的帧数
+LEGACY_PROBE_FRAMES = 50
+
+# 认定为旧视频需要的无帧头负载数，期间不能出现校验通过的帧头：
+# 识别错的负载不会带着正确的 CRC，却可能被当成无帧头的负载，只凭一个负载不下结论
+LEGACY_VOTES = 3
+
+# framecrc 的 F= 列是 AVPacket.flags，最低位表示关键帧
+AV_PKT_FLAG_KEY = 0x1
+
+# 分段解码时每段向后多读的秒数，避免切点处时间戳取整漏帧；重叠部分按分块序号去重
+SEGMENT_OVERLAP = 1.0
+
+
+def parse_payload(data):
+    """
+    逐个负载识别格式，不依赖本地设置：先按白化的字节模式还原并校验帧头，
+    不是的再按 base64 解开（旧格式，解开后可能带帧头，更早的视频没有帧头）。
+
+    :return: header.unpack 或 header.legacy 的结果；都不是或帧头校验失败时为 None
+    """
+    chunk = header.unpack(whiten(data))
+    if chunk is not None:
+        return chunk
+    try:
+        payload = base64.b64decode(data, validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    if header.is_framed(payload):
+        return header.unpack(payload)
+    return header.legacy(payload) if payload else None
 
 
 class QRDecoder:
-    def __init__(self, task_id, video_path, out_path, file_name, temp_dir,progress,  settings):
+    # 提交到进程池时只携带解码所需的字段
+    _WORKER_FIELDS = ("task_id", "video_path", "temp_dir", "settings", "ring")
+
+    def __init__(self, task_id, video_path, out_path, file_name, temp_dir,progress,  settings, pool=None, feed=None):
         self.task_id = task_id
         self.video_path = video_path
         self.temp_dir = temp_dir
         self.file_name = file_name
         self.progress = progress
+        self.settings = settings.read_decoder_setting()
+        self.pool = pool
+        # 流式解码时的共享内存环形缓冲区：{"name", "slots", "width", "height"}
+        self.ring = None
+        # 边下载边解码时的数据来源（按顺序产出视频字节，带 fraction 进度），此时 video_path 不可用
+        self.feed = feed
+        self._feed_error = None
+        self._last_thumb = None
+        # 负载是否带帧头，识别出第一个负载后确定
+        self._framed = None
 
         self.out_path = out_path
 
+    def __getstate__(self):
+        return {k: self.__dict__[k] for k in self._WORKER_FIELDS}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._last_thumb = None
+        self._framed = None
+
     def _fetch_frames(self):
 
         cmd = [
@@ -34,75 +119,628 @@ class QRDecoder:
 
         subprocess.run(cmd, check=True)
 
-    def _decode_img(self, img_path):
-        image = cv2.imread(f"{self.temp_dir}/img/{img_path}")
-        decoded_objects = decode(image)
+    def _get_block_codec(self):
+        block = self.settings["block"]
+        return cached(("block", tuple(sorted(block.items()))),
+                      lambda: BlockCodec(block["block_size"], block["cols"], block["rows"],
+                                         block["bits_per_block"], block["rs_nsym"]))
 
-        for obj in decoded_objects:
-            return base64.b64decode(obj.data)
+    def _decode_image(self, image):
+        """
+        返回帧内识别出的全部分块（header.unpack 或 header.legacy 的结果），帧头校验失败的已丢弃。
+        """
+        if self.settings["codec"] == "block":
+            data = self._get_block_codec().decode(image)
+            chunk = None if data is None else header.unpack(data)
+            return [] if chunk is None else [chunk]
 
+        if image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        if not self.settings["roi"]:
+            return [chunk for chunk, _ in self._scan(image)]
 
-    def _worker(self, imgs_queue, done_counter, completed_indexes, data_dic):
+        # 快速路径：码在每帧中的位置固定，只识别裁剪、缩小并二值化后的区域
+        roi = cached(("roi", self.task_id), dict)
+        if roi:
+            left, top, right, bottom = roi["box"]
+            crop = image[top:bottom, left:right]
+            if roi["scale"] < 1:
+                crop = cv2.resize(crop, None, fx=roi["scale"], fy=roi["scale"], interpolation=cv2.INTER_AREA)
+            _, crop = cv2.threshold(crop, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+            chunks = [chunk for chunk, _ in self._scan(crop, roi["count"])]
+            if self._is_complete(chunks):
+                return chunks
 
-        while True:
-            try:
-                img = imgs_queue.get(timeout=0.001)
+        # 快速路径识别不全时整帧搜索；整帧的码全部识别出来才重新定位，
+        # 否则漏掉的格子会被排除在裁剪区域之外，之后每帧都少这几个码
+        symbols = self._scan(image, roi.get("count", 1))
+        chunks = [chunk for chunk, _ in symbols]
+        if self._is_complete(chunks):
+            roi.update(self._locate(image, [rect for _, rect in symbols]))
+        return chunks
 
-                data = self._decode_img(img["img"])
-                data_dic[img["index"]] = data
-                with done_counter.get_lock():
-                    done_counter.value += 1
-                completed_indexes.append(img["index"])
+    @staticmethod
+    def _is_complete(chunks):
+        """
+        是否识别出了这一帧的全部码：按帧头，每帧 rows * cols 个，最后一帧只有剩下的分块；旧视频一帧一个。
+        """
+        framed = [chunk for chunk in chunks if chunk[0] != header.LEGACY_STREAM]
+        if not framed:
+            return bool(chunks)
+        _, index, total, params, _ = framed[0]
+        tiles = params.rows * params.cols
+        return len(framed) >= min(tiles, total - index // tiles * tiles)
 
-            except Empty:
-                break
+    def _scan(self, image, expected=1):
+        """
+        :return: [(分块, 码的外接矩形)]，识别不出格式的负载不计入
+        """
+        # 负载格式逐个识别，后端必须原样返回码里的字节；按能通过帧头校验的负载给后端排序
+        selector = cached(("backends", self.task_id),
+                          lambda: BackendSelector("binary", self.settings["backend"], parse_payload))
+        return selector.scan(image, expected)
 
-    def execute(self):
+    @staticmethod
+    def _module_size(image, rect):
+        """
+        沿码上边缘扫描左上角定位图形：其最上一行是连续 7 个深色模块。
+        """
+        row = image[rect.top + 1, rect.left:rect.left + rect.width]
+        dark = row < (int(row.min()) + int(row.max())) // 2
+        dark = dark[np.argmax(dark):]
+        run = np.argmin(dark) if not dark.all() else len(dark)
+        return run / 7
+
+    def _locate(self, image, rects):
+        """
+        由整帧识别到的码确定裁剪区域（留出静区）和缩放比例。
+        """
+        height, width = image.shape[:2]
+        left = min(rect.left for rect in rects)
+        top = min(rect.top for rect in rects)
+        right = max(rect.left + rect.width for rect in rects)
+        bottom = max(rect.top + rect.height for rect in rects)
+        margin = max(right - left, bottom - top) // 10
+        box = (max(0, left - margin), max(0, top - margin), min(width, right + margin), min(height, bottom + margin))
+
+        module = self._module_size(image, rects[0])
+        scale = float(MODULE_PIXELS / module) if module > MODULE_PIXELS else 1
+        return {"box": box, "scale": scale, "count": len(rects)}
+
+    @staticmethod
+    def _thumbnail(image):
+        if image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        return cv2.resize(image, DEDUPE_SIZE, interpolation=cv2.INTER_AREA)
+
+    def _is_duplicate(self, thumb):
+        """
+        平台把 1~5 fps 的视频转成 25/30 fps 后，同一分块会连续出现多帧。
+        与上一个完整解出的帧逐格比较缩略图，最大亮度差低于阈值视为同一帧。
+        不能用平均差：补零帧之间只有帧头不同，平均差接近 0。
+        """
+        return self._last_thumb is not None and \
+            cv2.absdiff(thumb, self._last_thumb).max() < self.settings["dedupe_threshold"]
+
+    def _parse_chunks(self, image):
+        """
+        在工作进程中解码一帧，CRC 不符的负载已丢弃；重复帧不解码，返回 None。
+        没有帧头的负载来自旧视频，由主进程按帧序放置；
+        旧视频相邻两帧可能本来就是相同的分块，不做重复帧判定。
+        """
+        thumb = self._thumbnail(image) if self.settings["dedupe_threshold"] else None
+        if thumb is not None and self._framed and self._is_duplicate(thumb):
+            return None
+        chunks = self._decode_image(image)
+        for chunk in chunks:
+            self._framed = chunk[0] != header.LEGACY_STREAM
+
+        if thumb is not None and self._framed and self._is_complete(chunks):
+            # 整帧都解出来才作为比较基准：转场处模糊的第一份没解出来时，后面更清晰的同一帧还会再解
+            self._last_thumb = thumb
+        return chunks
 
+    def _decode_batch(self, batch):
+        return [(index, self._parse_chunks(cv2.imread(f"{self.temp_dir}/img/{img}"))) for index, img in batch]
+
+    def _decode_ring_batch(self, batch):
+        """
+        按槽位直接读取共享内存中的灰度帧，每批连接一次，用完即断开。
+        """
+        ring = shared_memory.SharedMemory(name=self.ring["name"])
+        frames = np.ndarray((self.ring["slots"], self.ring["height"], self.ring["width"]),
+                            dtype=np.uint8, buffer=ring.buf)
+        try:
+            return [(index, self._parse_chunks(frames[slot])) for index, slot in batch]
+        finally:
+            del frames
+            ring.close()
+
+    def _map_frames(self, func, items, max_inflight=None, batch_size=None):
+        pool = self.pool or CoderPool()
+        try:
+            yield from pool.map_batches(func, self, items, max_inflight, batch_size)
+        finally:
+            if self.pool is None:
+                pool.close()
+
+    def _decode_files(self):
+        """
+        旧流程：ffmpeg 先把全部帧导出为 PNG，再逐个读图解码。
+        """
         self._fetch_frames()
 
         imgs = os.listdir(f"{self.temp_dir}/img")
         imgs = natsorted(imgs, key=lambda x: int(x.split('.')[0]))
         self.total_imgs = len(imgs)
+        pending = ((index, img) for index, img in enumerate(imgs, start=1) if index - 1 not in self.completed)
+        yield from self._map_frames(_decode_batch, pending)
+
+    @staticmethod
+    def _read_y4m_header(stdout):
+        """
+        读取 yuv4mpeg 流头 "YUV4MPEG2 W<宽> H<高> ..."，空流返回 None。
+        """
+        line = stdout.readline()
+        if not line:
+            return None
+        fields = {field[:1]: field[1:] for field in line.split()[1:]}
+        return int(fields[b"W"]), int(fields[b"H"])
+
+    @staticmethod
+    def _read_frame(stdout, frame):
+        """
+        跳过帧头 "FRAME" 行，从 ffmpeg 的 yuv4mpeg 输出读满一帧到 frame，读到结尾返回 False。
+        """
+        if not stdout.readline():
+            return False
+        view = memoryview(frame).cast("B")
+        filled = 0
+        while filled < len(view):
+            read = stdout.readinto(view[filled:])
+            if not read:
+                return False
+            filled += read
+        return True
+
+    def _read_ring(self, stdout, frames):
+        """
+        把 ffmpeg 输出的帧依次直接读进环形缓冲区，产出 (index, 槽位)。
+        上次已解码的帧读出后直接丢弃，槽位留给下一帧。
+        """
+        slots = len(frames)
+        slot = 0
+        index = 0
+        while self._read_frame(stdout, frames[slot]):
+            index += 1
+            if self.feed is not None and self.feed.fraction:
+                # 总帧数未知，按已送入 ffmpeg 的数据比例外推，解码进度跟随下载进度
+                self.total_imgs = max(index + 1, int(index / self.feed.fraction))
+            if index - 1 in self.completed:
+                continue
+            yield index, slot
+            slot = (slot + 1) % slots
+
+    def _estimate_frames(self):
+        """
+        用容器记录的帧数估计总帧数，只用于进度显示。
+        """
+        capture = cv2.VideoCapture(self.video_path)
+        self.total_imgs = max(1, int(capture.get(cv2.CAP_PROP_FRAME_COUNT)))
+        capture.release()
+
+    def _feed_ffmpeg(self, stdin):
+        try:
+            for data in self.feed:
+                stdin.write(data)
+        except (BrokenPipeError, OSError):
+            # ffmpeg 提前退出（例如容器不支持管道输入），由它的返回码报告
+            pass
+        except Exception as e:
+            self._feed_error = e
+        finally:
+            try:
+                stdin.close()
+            except OSError:
+                pass
 
-        imgs_queue = Queue()
-        i = 1
-        for img in imgs:
-            imgs_queue.put({"index":i, "img":img})
-            i += 1
-        manager = Manager()
-        self.done_counter = Value('i', 0)
-        self.completed_indexes = manager.list()
-        data_list = manager.dict()
-
-        processes = []
-        for _ in range(os.cpu_count()):
-            p = Process(target=self._worker, args=(imgs_queue, self.done_counter, self.completed_indexes, data_list))
-            processes.append(p)
-            p.start()
-
-        self._update_progress()
-
-        sorted_indices = sorted(data_list.keys())
-        binary_data = bytearray()
-        for index in sorted_indices:
-            binary_data.extend(data_list[index])
-        with open(f"{self.out_path}/{self.file_name}", "wb") as f:
-            f.write(binary_data)
+    def _decode_stream(self):
+        """
+        流式流程：单个 ffmpeg 进程输出灰度 yuv4mpeg，帧放入共享内存环形缓冲区，
+        工作进程按槽位解码，不产生任何图片文件。有 feed 时 ffmpeg 从 stdin 读取正在下载的视频。
+        """
+        if self.feed is None:
+            self._estimate_frames()
+        cmd = ["ffmpeg", "-i", "-" if self.feed is not None else self.video_path, "-vsync", "0"] + Y4M_OUTPUT
+        ffmpeg = subprocess.Popen(cmd, stdin=subprocess.PIPE if self.feed is not None else None,
+                                  stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        if self.feed is not None:
+            # 下载可能停在半途，写入线程设为守护线程，不在这里等待它
+            threading.Thread(target=self._feed_ffmpeg, args=(ffmpeg.stdin,), daemon=True).start()
+
+        try:
+            size = self._read_y4m_header(ffmpeg.stdout)
+            if size is not None:
+                yield from self._decode_ring(ffmpeg.stdout, *size)
+        finally:
+            ffmpeg.stdout.close()
+            ffmpeg.wait()
+
+        if self._feed_error is not None:
+            raise self._feed_error
+        if ffmpeg.returncode != 0:
+            raise subprocess.CalledProcessError(ffmpeg.returncode, cmd)
+        # 容器里记录的帧数只是估计，以实际读到的帧数为准
+        self.total_imgs = max(1, self.completed.count)
+
+    def _decode_ring(self, stdout, width, height):
+        """
+        环形缓冲区的槽位数同时作为在途帧上限，槽位只在其结果取回后才会被复用。
+        """
+        pool_batch = self.pool.batch_size if self.pool is not None else 8
+        slots = max(self.settings["ring_slots"], pool_batch)
+        ring = shared_memory.SharedMemory(create=True, size=slots * width * height)
+        self.ring = {"name": ring.name, "slots": slots, "width": width, "height": height}
+
+        frames = np.ndarray((slots, height, width), dtype=np.uint8, buffer=ring.buf)
+        reader = self._read_ring(stdout, frames)
+        try:
+            yield from self._map_frames(_decode_ring_batch, reader, slots)
+        finally:
+            # 读取生成器持有共享内存的视图，必须先关闭才能释放共享内存
+            reader.close()
+            del frames
+            ring.close()
+            ring.unlink()
+            self.ring = None
+
+    def _probe_keyframes(self):
+        """
+        只解复用不解码，用 framecrc 列出视频包：标志不是单纯的关键帧时带 F= 列，有附加数据时还带 S= 列。
+
+        :return: (关键帧时间列表, 时长)，时间都相对第一个包，单位秒
+        """
+        cmd = ["ffmpeg", "-v", "error", "-i", self.video_path, "-map", "0:v:0", "-c", "copy", "-f", "framecrc", "-"]
+        output = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+
+        time_base = Fraction(1)
+        packets = []
+        for line in output.splitlines():
+            if line.startswith("#tb"):
+                time_base = Fraction(line.split(":")[1].strip())
+            elif line and not line.startswith("#"):
+                fields = [field.strip() for field in line.split(",")]
+                flags = next((int(field[2:], 16) for field in fields[6:] if field.startswith("F=")), AV_PKT_FLAG_KEY)
+                packets.append((int(fields[2]), int(fields[3]), bool(flags & AV_PKT_FLAG_KEY)))
+
+        first = min(pts for pts, _, _ in packets)
+        keyframes = sorted(float((pts - first) * time_base) for pts, _, key in packets if key)
+        duration = float((max(pts + length for pts, length, _ in packets) - first) * time_base)
+        return keyframes, duration
+
+    def _split_segments(self, keyframes, duration):
+        """
+        把时长切成约 segment_seconds 长的段，每个切点对齐到最近的关键帧。
+        段数不随进程数封顶：工作进程整段解完才返回结果，段短才能让内存占用与视频长度无关，
+        同时在途的段数由进程池限制。
+        """
+        count = max(1, int(duration // self.settings["segment_seconds"]))
+
+        bounds = [0.0]
+        for k in range(1, count):
+            target = duration * k / count
+            i = bisect.bisect_left(keyframes, target)
+            keyframe = min(keyframes[max(0, i - 1):i + 1], key=lambda t: abs(t - target))
+            if keyframe > bounds[-1]:
+                bounds.append(keyframe)
+        return list(zip(bounds, bounds[1:] + [None]))
+
+    def _decode_segment(self, segment):
+        """
+        在工作进程中用独立的 ffmpeg 抽取并解码一个时间段，返回逐帧的分块列表。
+        同一段内已出现过的分块不再重复返回，减少回传的数据量。
+        """
+        start, end = segment
+        cmd = ["ffmpeg", "-ss", f"{start:.6f}", "-i", self.video_path]
+        if end is not None:
+            cmd += ["-t", f"{end - start + SEGMENT_OVERLAP:.6f}"]
+        cmd += ["-vsync", "0"] + Y4M_OUTPUT
+
+        seen = set()
+        results = []
+        ffmpeg = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        try:
+            size = self._read_y4m_header(ffmpeg.stdout)
+            frame = None if size is None else np.empty((size[1], size[0]), dtype=np.uint8)
+            while frame is not None and self._read_frame(ffmpeg.stdout, frame):
+                chunks = self._parse_chunks(frame)
+                if chunks is not None:
+                    chunks = [chunk for chunk in chunks if chunk[:2] not in seen]
+                    seen.update(chunk[:2] for chunk in chunks)
+                results.append(chunks)
+        finally:
+            ffmpeg.stdout.close()
+            ffmpeg.wait()
+
+        if ffmpeg.returncode != 0:
+            raise subprocess.CalledProcessError(ffmpeg.returncode, cmd)
+        return results
+
+    def _is_legacy(self):
+        """
+        解码视频开头的帧，判断是否为没有帧头的旧视频：出现校验通过的帧头就不是，
+        攒够 LEGACY_VOTES 个无帧头的负载才是。开头的帧里判断不出时返回 None，留给解码过程继续判断。
+        """
+        votes = 0
+        cmd = ["ffmpeg", "-i", self.video_path, "-frames:v", str(LEGACY_PROBE_FRAMES), "-vsync", "0"] + Y4M_OUTPUT
+        ffmpeg = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        try:
+            size = self._read_y4m_header(ffmpeg.stdout)
+            frame = None if size is None else np.empty((size[1], size[0]), dtype=np.uint8)
+            while frame is not None and self._read_frame(ffmpeg.stdout, frame):
+                for chunk in self._decode_image(frame):
+                    if chunk[0] != header.LEGACY_STREAM:
+                        return False
+                    votes += 1
+                    if votes >= LEGACY_VOTES:
+                        return True
+        finally:
+            ffmpeg.stdout.close()
+            ffmpeg.wait()
+        return None
+
+    def _decode_segments(self):
+        """
+        分段流程：按关键帧把视频切成若干时间段，每段由一个工作进程独立抽帧解码，
+        长视频的抽帧也随核数并行；结果按分块序号合并。时长不足两段时退回单路流式解码。
+
+        切分结果保存在进度里，继续任务时沿用同一切分并跳过已完成的段；
+        段内帧数事先未知，续上的帧从已完成帧数往后编号。
+        """
+        self._estimate_frames()
+        saved = self.progress["decode"][0]
+        if saved.get("segments"):
+            segments = [tuple(segment) for segment in saved["segments"]]
+        elif self.legacy is not False:
+            # 旧视频按帧序放置分块，分段之间的重叠会打乱帧号，只能单路顺序解码；还没判断出来的也按旧视频处理
+            segments = []
+        else:
+            segments = self._split_segments(*self._probe_keyframes())
+            saved["segments"] = segments
+        if len(segments) < 2:
+            yield from self._decode_stream()
+            return
+
+        pending = [k for k in range(len(segments)) if k not in self.completed_segments]
+        index = self.completed.count
+        results = self._map_frames(_decode_segment_batch, [segments[k] for k in pending], batch_size=1)
+        for frames, k in zip(results, pending):
+            for chunks in frames:
+                index += 1
+                yield index, chunks
+            self.completed_segments.add(k)
+        self.total_imgs = max(1, self.completed.count)
+
+    def _load_progress(self):
+        """
+        读取中断前保存的进度：已解码的帧和段、已写入的分块、锁定的流 id 和帧计数。
+        received.bin 不在了就从头开始。
+
+        :return: ChunkWriter 的恢复状态，没有可恢复的进度时为 None
+        """
+        saved = self.progress["decode"][0]
+        path = os.path.join(self.temp_dir, "received.bin")
+        state = saved.get("writer")
+        if not state or not os.path.exists(path):
+            saved["segments"] = None
+            saved["is_decode"] = False
+            return None
+
+        self.completed = ProgressBitmap.loads(saved.get("completed_img_bitmap", ""))
+        self.completed_segments = ProgressBitmap.loads(saved.get("completed_segment_bitmap", ""))
+        self.stream = saved.get("stream_id")
+        if self.stream is not None:
+            self.legacy = self.stream == header.LEGACY_STREAM
+        if saved.get("stream_params"):
+            self.params = header.StreamParams(*saved["stream_params"])
+        self.skipped_frames = saved.get("skipped_frames", 0)
+        self.decoded_frames = saved.get("decoded_frames", 0)
+        return dict(state, present=saved["completed_chucks_bitmap"])
+
+    def execute(self):
+        """
+        解码视频并写出文件；同一临时目录下再次执行时从上次中断处继续。
+        """
+        if self.progress["decode"][1]["is_wirte_file"]:
+            return
+
+        self.completed = ProgressBitmap()
+        self.completed_segments = ProgressBitmap()
+        self.total_imgs = 1
+        self.stream = None
+        self.params = None
+        # 是否为没有帧头的旧视频，每个视频只判断一次；None 表示还没判断出来
+        self.legacy = None
+        self._unsettled = []
+        self.skipped_frames = 0
+        self.decoded_frames = 0
+        state = self._load_progress()
+        writer = self.writer = ChunkWriter(os.path.join(self.temp_dir, "received.bin"), state)
+
+        finished = self.progress["decode"][0]["is_decode"] or writer.complete
+        if self.legacy is None and self.feed is None and not finished:
+            # 解码前先判断是否为旧视频；边下载边解码时无法预先探测，只能在解码过程中判断
+            self._settle(writer, self._is_legacy())
+
+        if finished:
+            # 所有帧都解过或所有分块都已落盘，直接写出文件
+            frames = []
+            self.total_imgs = max(1, self.completed.count)
+        elif self.feed is not None:
+            # 边下载边解码只能顺序读取
+            frames = self._decode_stream()
+        elif self.settings["extract_mode"] == "segment":
+            frames = self._decode_segments()
+        elif self.settings["extract_mode"] == "stream":
+            frames = self._decode_stream()
+        else:
+            frames = self._decode_files()
+
+        self._decode_stopped = threading.Event()
+        updater = threading.Thread(target=self._update_progress)
+        updater.start()
+        try:
+            # 分块按帧头序号归位：平台重复的帧自然去重，丢帧/乱序不影响其它分块
+            for index, chunks in frames:
+                if chunks is None:
+                    self.skipped_frames += 1
+                    chunks = []
+                else:
+                    self.decoded_frames += 1
+                for chunk in chunks:
+                    self._place(writer, index, chunk)
+                if not any(unsettled == index for unsettled, _ in self._unsettled):
+                    # 暂存了负载的帧等判断出是否旧视频后再标记完成，中断后会重新解码
+                    self.completed.add(index - 1)
+                if writer.complete:
+                    # 分块已经收齐，剩下的帧不必再解码
+                    frames.close()
+                    self.total_imgs = max(1, self.completed.count)
+                    break
+            if self.legacy is None and self._unsettled:
+                # 视频里识别出的负载都没有帧头（短于 LEGACY_VOTES 帧的旧视频）
+                self._settle(writer, True)
+            writer.finish()
+        finally:
+            # 先停掉进度线程再关闭文件，它保存进度时要刷盘
+            self._decode_stopped.set()
+            updater.join()
+            writer.close()
+
+        self._write_output(writer)
         self.progress["decode"][1]["is_wirte_file"] = True
+        write_progress_json(self.temp_dir, self.progress)
+
+    def _place(self, writer, index, chunk):
+        """
+        把第 index 帧识别出的分块写入：旧视频只收没有帧头的负载，新视频只收第一个校验通过的流。
+        还没判断出是否旧视频时，无帧头的负载先暂存，攒够 LEGACY_VOTES 个才认定为旧视频。
+        """
+        chunk_stream, chunk_index, total, params, data = chunk
+        if chunk_stream == header.LEGACY_STREAM:
+            if self.legacy is None:
+                self._unsettled.append((index, data))
+                if len(self._unsettled) >= LEGACY_VOTES:
+                    self._settle(writer, True)
+            elif self.legacy:
+                # 旧视频一帧一块，第 index 帧就是第 index - 1 块
+                writer.write_unframed(index - 1, data)
+            return
+
+        if self.legacy is None:
+            self._settle(writer, False)
+        if self.legacy:
+            return
+        if self.stream is None:
+            # 锁定第一个校验通过的流，纠删码和平铺参数以它的帧头为准
+            self.stream = chunk_stream
+            self.params = params
+        if chunk_stream == self.stream:
+            writer.write(chunk_index, total, data)
+
+    def _settle(self, writer, legacy):
+        """
+        确定是否为旧视频，处理暂存的无帧头负载：旧视频按帧序写入，新视频里的直接丢弃。
+        """
+        if legacy is None:
+            return
+        self.legacy = legacy
+        if legacy:
+            self.stream = header.LEGACY_STREAM
+            self.params = header.LEGACY_PARAMS
+        for index, data in self._unsettled:
+            if legacy:
+                writer.write_unframed(index - 1, data)
+            self.completed.add(index - 1)
+        self._unsettled.clear()
+
+    def _write_output(self, writer):
+        """
+        依次做纠删恢复和解压，都是流式读写临时文件，最后移动到输出位置。
+        """
+        if writer.chunk_size is None:
+            raise RuntimeError("No chunk could be decoded from the video")
+        if not writer.complete and not writer.unframed and not self.params.fec_parity:
+            # 帧头给出了分块总数，没有纠删码时缺块无从恢复，不能把留空的文件当结果写出
+            raise RuntimeError(f"{writer.total - writer.present.count} of {writer.total} chunks could not be decoded "
+                               f"and the video has no FEC to rebuild them")
+
+        path = writer.path
+        if self.params.fec_parity:
+            recovered = os.path.join(self.temp_dir, "recovered.bin")
+            with open(writer.path, "rb") as src, open(recovered, "wb") as dst:
+                self._recover(writer, src, dst)
+            path = recovered
+
+        out = f"{self.out_path}/{self.file_name}"
+        if self.params.compression:
+            # 编码端压缩过，由流参数标明，不靠数据开头的字节猜测
+            with open(path, "rb") as src, open(out, "wb") as dst:
+                compress.decompress_stream(src, dst)
+            return
+        shutil.move(path, out)
+
+    def _recover(self, writer, src, dst):
+        """
+        按帧读取负载（任一格子缺失即视为整帧丢失），再用跨帧纠删码重建丢失的帧。
+        """
+        params = self.params
+        tiles = params.rows * params.cols
+        frame_bytes = writer.chunk_size * tiles
+        total_frames = (writer.total + tiles - 1) // tiles
+
+        def read_frame(frame):
+            if not all(writer.has(frame * tiles + slot) for slot in range(tiles)):
+                return None
+            src.seek(frame * frame_bytes)
+            return src.read(frame_bytes)
+
+        fec = FrameFEC(params.fec_data, params.fec_parity, params.fec_interleave)
+        fec.decode_stream(read_frame, total_frames, frame_bytes, dst)
+
+    def _snapshot(self):
+        """
+        按完成的先后倒序取位图：段完成前其帧都已完成，帧完成前其分块都已写入，
+        最后由 ChunkWriter 刷盘，保存下来的进度不会超前于文件内容。
+        """
+        segments = self.completed_segments.dumps()
+        frames = self.completed.dumps()
+        state = self.writer.state()
+        if state is None:
+            return {"completed_segment_bitmap": "", "completed_img_bitmap": "", "completed_chucks_bitmap": "",
+                    "writer": None}
+        return {"completed_segment_bitmap": segments, "completed_img_bitmap": frames,
+                "completed_chucks_bitmap": state.pop("present"), "writer": state}
 
     def _update_progress(self):
         while True:
-            with self.done_counter.get_lock():
-                current = self.done_counter.value
+            # 流式解码时总帧数在结束前只是估计值，先取停止标志，保证最后一轮用的是最终计数
+            stopped = self._decode_stopped.is_set()
+            current = self.completed.count
 
             print(current, self.total_imgs)
-            self.progress["decode"][0]["percent"] = (current / self.total_imgs) * 100
-            self.progress["decode"][0]["completed_img_indexes"] = list(self.completed_indexes)
+            percent = min(current / self.total_imgs * 100, 100.0)
+            self.progress["decode"][0]["percent"] = percent
+            self.progress["decode"][0].update(self._snapshot())
+            self.progress["decode"][0]["stream_id"] = self.stream
+            self.progress["decode"][0]["stream_params"] = self.params
+            self.progress["decode"][0]["skipped_frames"] = self.skipped_frames
+            self.progress["decode"][0]["decoded_frames"] = self.decoded_frames
+            if stopped and percent == 100.0:
+                self.progress["decode"][0]["is_decode"] = True
             write_progress_json(self.temp_dir, self.progress)
 
-            if current / self.total_imgs * 100 == 100.0:
-                self.progress["decode"][0]["is_decode"] = True
+            if stopped:
                 break
             time.sleep(0.1)
 
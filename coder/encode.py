@@ -1,72 +1,316 @@
 import base64
+import mmap
 import os
 import shutil
 import subprocess
+import threading
 import time
-from multiprocessing import Process, Queue, Manager, Value, cpu_count
-from queue import Empty
 
+import cv2
 import qrcode
+from qrcode.util import MODE_8BIT_BYTE, QRData
 
-from tool.progress_json import write_progress_json
+from coder import compress, header
+from coder.block import BlockCodec
+from coder.fec import FrameFEC
+from coder.pool import CoderPool, cached
+from coder.raster import QRRasterizer
+from coder.whiten import whiten
+from tool.progress_json import ProgressBitmap, write_progress_json
+
+
+# 分片 MP4：moov 写在文件头，之后每秒追加一个分片、从不回写，边编码边上传时已写出的字节不会再变
+FRAGMENTED_MP4 = ["-movflags", "frag_keyframe+empty_moov+default_base_moof", "-frag_duration", "1000000"]
+
+
+def _encode_batch(render, batch):
+    return render._encode_batch(batch)
+
+
+def _compress_batch(render, batch):
+    return render._compress_batch(batch)
+
+
+def _block_codec(block):
+    return cached(("block", tuple(sorted(block.items()))),
+                  lambda: BlockCodec(block["block_size"], block["cols"], block["rows"],
+                                     block["bits_per_block"], block["rs_nsym"]))
+
+
+def frame_payload(settings):
+    """
+    按编码设置（Setting.read_encoder_setting）每帧承载的数据字节数，不含帧头。
+    """
+    if settings["codec"] == "block":
+        return _block_codec(settings["block"]).payload_size - header.SIZE
+    return settings["chuck_size"] * settings["grid"][0] * settings["grid"][1]
 
 
 class QRender:
-    def __init__(self, task_id, file_path, temp_dir, settings, progress, mode):
+    # 提交到进程池时只携带渲染所需的字段
+    _WORKER_FIELDS = ("task_id", "file_path", "temp_dir", "settings", "tiles", "qr_version", "is_stream",
+                      "compression", "stream_id", "stream_params", "total_chunks")
+
+    def __init__(self, task_id, file_path, temp_dir, settings, progress, mode, pool=None, file_range=None):
+        """
+        :param file_range: (偏移, 长度)，只编码文件中的这一段（分片上传），默认整个文件
+        """
         self.task_id = task_id
         self.progress = progress
         self.file_path = file_path
+        self.file_offset, self.file_length = file_range or (0, None)
         self.mode = mode
         self.temp_dir = temp_dir
         self.settings = settings.read_encoder_setting()
+        self.tiles = self.settings["grid"][0] * self.settings["grid"][1]
+        self.is_stream = self.settings["composite_mode"] == "stream"
+        self.qr_version = None
+        self.compression = None
+        self.stream_id = header.stream_id(task_id)
+        self.stream_params = None
+        self.total_chunks = None
+        self.pool = pool
+        self._file_map = None
+
+    def __getstate__(self):
+        return {k: self.__dict__[k] for k in self._WORKER_FIELDS}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._file_map = None
 
     def _read_file_chunks(self):
-        with open(self.file_path, 'rb') as f:
-            chunk_size = self.settings["chuck_size"]
-            index = 0
-            while True:
-                chunk = f.read(chunk_size)
+        """
+        只产出 (index, offset, length) 工作项，每项对应一帧（grid 个分块），
+        数据由工作进程从 mmap 中按需读取。
+        """
+        frame_bytes = self._frame_bytes()
+        for index in range(self.total_frames):
+            offset = index * frame_bytes
+            yield index, self.file_offset + offset, min(frame_bytes, self.file_size - offset)
 
-                if not chunk:
-                    break
-                yield {"index": index, "data": chunk}
-                index += 1
+    def _frame_bytes(self):
+        return frame_payload(self.settings)
 
-    def _generate_chunk_qr(self, chunk_data, index):
+    def _stream_params(self):
+        """
+        写进每个分块帧头的纠删码参数、平铺行列数和压缩方法，压缩方法在 _compress_input 之后才确定。
+        """
+        fec = self.settings["fec"]
+        rows, cols = self.settings["grid"] if self.settings["codec"] == "qr" else (1, 1)
+        compression = compress.METHODS[self.compression] if self.compression else 0
+        if not fec["parity"]:
+            return header.StreamParams(0, 0, 0, rows, cols, compression)
+        return header.StreamParams(fec["data"], fec["parity"], fec["interleave"], rows, cols, compression)
 
+    def _pack_chunk(self, index, chunk_data):
+        return header.pack(self.stream_id, index, self.total_chunks, self.stream_params, chunk_data)
+
+    def _get_block_codec(self):
+        return _block_codec(self.settings["block"])
+
+    def _read_chunk(self, offset, length):
+        return memoryview(self._file_map)[offset:offset + length]
+
+    def _payload(self, chunk_data):
+        """
+        binary：原始字节白化后直接以 QR 字节模式写入；base64：旧格式，容量损失约 1/3。
+        """
+        if self.settings["payload_format"] == "binary":
+            return QRData(whiten(chunk_data), mode=MODE_8BIT_BYTE, check_data=False)
+        return base64.b64encode(chunk_data).decode('utf-8')
+
+    def _make_qr(self, chunk_data):
         qr = qrcode.QRCode(
+            version=self.qr_version,
             error_correction=self.settings["error_correction"],
             box_size=self.settings["box_size"],
             border=self.settings["boder"],
         )
-        qr.add_data(base64.b64encode(chunk_data).decode('utf-8'))
+        qr.add_data(self._payload(chunk_data))
         qr.make(fit=False)
-        img = qr.make_image(fill_color="black", back_color="white")
-        self.qr_size["size"] = img.size
-        img.save(os.path.join(self.temp_dir, "img", f"{index}.png"))
+        return qr
 
-    def _worker(self, chunk_queue, done_counter, completed_indexes):
+    def _get_rasterizer(self):
+        key = ("qr", self.settings["box_size"], self.settings["boder"],
+               tuple(self.settings["grid"]), self.settings["tile_gap"])
+        return cached(key, lambda: QRRasterizer(self.settings["box_size"], self.settings["boder"],
+                                                self.settings["grid"], self.settings["tile_gap"]))
 
-        while True:
-            try:
-                chunk = chunk_queue.get()
-            except Empty:
-                break
+    def _rasterize(self, frame_data, index):
+        """
+        每个分块带上帧头后编码；第 index 帧的分块序号从 index * tiles 开始。
+        """
+        if self.settings["codec"] == "block":
+            return self._get_block_codec().encode(self._pack_chunk(index, frame_data))
 
-            self._generate_chunk_qr(chunk["data"], chunk["index"])
+        chunk_size = self.settings["chuck_size"]
+        modules_list = [self._make_qr(self._pack_chunk(index * self.tiles + i // chunk_size,
+                                                       frame_data[i:i + chunk_size])).modules
+                        for i in range(0, len(frame_data), chunk_size)]
+        return self._get_rasterizer().render_tiles(modules_list)
 
-            with done_counter.get_lock():
-                done_counter.value += 1
-            completed_indexes.append(chunk["index"])
+    def _generate_chunk_qr(self, frame_data, index):
+        frame = self._rasterize(frame_data, index)
+        cv2.imwrite(os.path.join(self.temp_dir, "img", f"{index}.png"), frame)
 
-    def _composite_video(self):
+    def _render_chunk_frame(self, frame_data, index):
+        """
+        生成单帧灰度原始像素（rawvideo/gray），不落盘。
+        """
+        return self._rasterize(frame_data, index).tobytes()
+
+    def _fix_qr_version(self):
+        """
+        所有帧（以及平铺的每个码）尺寸必须一致，用一个满长度分块确定统一的 QR 版本。
+        """
+        if self.settings["codec"] == "block":
+            self.qr_size["size"] = self._get_block_codec().frame_size()
+            return
+
+        qr = qrcode.QRCode(
+            error_correction=self.settings["error_correction"],
+            box_size=self.settings["box_size"],
+            border=self.settings["boder"],
+        )
+        with open(self.file_path, 'rb') as f:
+            f.seek(self.file_offset)
+            first_chunk = f.read(min(self.settings["chuck_size"], self.file_length))
+        qr.add_data(self._payload(self._pack_chunk(0, first_chunk)))
+        qr.make(fit=True)
+        self.qr_version = qr.version
 
+        self.qr_size["size"] = self._get_rasterizer().frame_size(qr.modules_count)
+
+    def _encode_batch(self, batch):
+        """
+        在工作进程中渲染一批帧：流式模式返回原始帧，图片模式直接落盘。
+        """
+        results = []
+        with open(self.file_path, 'rb') as f:
+            self._file_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for index, offset, length in batch:
+                data = self._read_chunk(offset, length)
+                if self.is_stream:
+                    results.append((index, self._render_chunk_frame(data, index)))
+                else:
+                    self._generate_chunk_qr(data, index)
+                    results.append((index, None))
+                data.release()
+        finally:
+            self._file_map.close()
+            self._file_map = None
+        return results
+
+    def _video_fps(self):
         fps = self.settings["fps"]
-        os.path.join(self.temp_dir, "output", f"{self.task_id}.mp4")
 
         min_duration = 1.0
-        if self.total_chunks / fps < min_duration:
-            fps = max(1, int(self.total_chunks / min_duration))
+        if self.total_frames / fps < min_duration:
+            fps = max(1, int(self.total_frames / min_duration))
+        return fps
+
+    def _compress_batch(self, batch):
+        results = []
+        with open(self.file_path, 'rb') as f:
+            for offset, length in batch:
+                f.seek(offset)
+                results.append(compress.compress_block(self.compression, f.read(length)))
+        return results
+
+    def _compress_input(self, pool):
+        """
+        对可压缩的输入分块并行压缩，流式写入临时文件，之后改为编码该文件。
+        """
+        self.compression = compress.choose_method(self.file_path, self.settings["compression"],
+                                                  self.file_offset, self.file_length)
+        if self.compression is None:
+            return
+
+        block_size = self.settings["compress_block"]
+        size = self.file_length
+        blocks = ((self.file_offset + offset, min(block_size, size - offset)) for offset in range(0, size, block_size))
+        compressed_path = os.path.join(self.temp_dir, "compressed.bin")
+        with open(compressed_path, 'wb') as f:
+            compress.write_header(f, self.compression)
+            # 每批一个块，在途块数约为进程数的两倍
+            for block in pool.map_batches(_compress_batch, self, blocks, batch_size=1):
+                compress.write_block(f, block)
+
+        if os.path.getsize(compressed_path) < size:
+            self.file_path = compressed_path
+            self.file_offset, self.file_length = 0, os.path.getsize(compressed_path)
+        else:
+            self.compression = None
+            os.remove(compressed_path)
+
+    def _protect_input(self):
+        """
+        加入跨帧纠删校验帧，平台转码丢掉的少量帧可在解码端本地重建。
+        """
+        fec = self.settings["fec"]
+        if not fec["parity"]:
+            return
+
+        fec_path = os.path.join(self.temp_dir, "fec.bin")
+        with open(self.file_path, 'rb') as src, open(fec_path, 'wb') as dst:
+            src.seek(self.file_offset)
+            FrameFEC(fec["data"], fec["parity"], fec["interleave"]).encode_stream(src, dst, self.file_length,
+                                                                                   self._frame_bytes())
+        self.file_path = fec_path
+        self.file_offset, self.file_length = 0, os.path.getsize(fec_path)
+
+    def _render_frames(self, pool):
+        """
+        经进程池按索引顺序渲染全部帧，逐帧产出 (index, 原始帧或 None)。
+        """
+        # 在途帧数受 inflight_frames 限制，内存占用与文件大小无关
+        return pool.map_batches(_encode_batch, self, self._read_file_chunks(),
+                                self.settings["inflight_frames"])
+
+    def _collect_frames(self, frames, stdin=None):
+        for index, frame in frames:
+            if stdin is not None:
+                stdin.write(frame)
+            self.completed.add(index)
+
+    def _container_args(self):
+        return FRAGMENTED_MP4 if self.settings["fragmented"] else []
+
+    def _stream_video(self, frames):
+        """
+        把按序渲染的原始帧写入单个 ffmpeg 进程的 stdin。
+        """
+        width, height = self.qr_size["size"]
+        cmd = [
+            "ffmpeg", "-y",
+            "-f", "rawvideo",
+            "-pix_fmt", "gray",
+            "-s", f"{width}x{height}",
+            "-framerate", str(self._video_fps()),
+            "-i", "-",
+            "-c:v", "libx264",
+            "-pix_fmt", "yuv420p",
+            "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2",
+            *self._container_args(),
+            self.result_path()
+        ]
+
+        ffmpeg = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            self._collect_frames(frames, ffmpeg.stdin)
+        finally:
+            ffmpeg.stdin.close()
+            ffmpeg.wait()
+
+        if ffmpeg.returncode != 0:
+            raise subprocess.CalledProcessError(ffmpeg.returncode, cmd)
+
+    def _composite_video(self):
+
+        fps = self._video_fps()
 
         cmd = [
             "ffmpeg", "-y",
@@ -76,7 +320,8 @@ class QRender:
             "-c:v", "libx264",
             "-pix_fmt", "yuv420p",
             "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2",
-            f"{self.temp_dir}/output/{self.task_id}.mp4"
+            *self._container_args(),
+            self.result_path()
         ]
 
         subprocess.run(cmd, check=True, capture_output=True)
@@ -84,43 +329,62 @@ class QRender:
 
     def _update_progress(self):
         while True:
-            with self.done_counter.get_lock():
-                current = self.done_counter.value
+            current = self.completed.count
 
-            self.progress["encode"][0]["percent"] = current / self.total_chunks * 100
-            self.progress["encode"][0]["completed_chucks_indexes"] = list(self.completed_indexes)
+            self.progress["encode"][0]["percent"] = current / self.total_frames * 100
+            self.progress["encode"][0]["completed_chucks_bitmap"] = self.completed.dumps()
             write_progress_json(self.temp_dir, self.progress)
 
-            if current / self.total_chunks * 100 == 100.0:
+            if current / self.total_frames * 100 == 100.0 or self._render_stopped.is_set():
                 break
             time.sleep(0.1)
 
 
     def execute(self):
+        if self.file_length is None:
+            # 到真正编码时才取大小：只补传已合成视频的任务，源文件可能已经不在了
+            self.file_length = os.path.getsize(self.file_path)
+        pool = self.pool or CoderPool()
+        try:
+            self._compress_input(pool)
+            self._protect_input()
+            self._encode(pool)
+        finally:
+            if self.pool is None:
+                pool.close()
+
+    def _encode(self, pool):
+
+        self.qr_size = {}
+        self.stream_params = self._stream_params()
+        self.file_size = self.file_length
+        frame_bytes = self._frame_bytes()
+        self.total_frames = (self.file_size + frame_bytes - 1) // frame_bytes
+        self.completed = ProgressBitmap(self.total_frames)
+        if self.settings["codec"] == "block":
+            self.total_chunks = self.total_frames
+        else:
+            chunk_size = self.settings["chuck_size"]
+            self.total_chunks = (self.file_size + chunk_size - 1) // chunk_size
+
+        self._fix_qr_version()
 
-        manager = Manager()
-        chunk_queue = Queue()
-        self.done_counter = Value('i', 0)
-        self.completed_indexes = manager.list()
-        self.qr_size = manager.dict()
-        self.chunks = list(self._read_file_chunks())
-        self.total_chunks = len(self.chunks)
-
-        for i in self.chunks:
-            chunk_queue.put(i)
-
-        processes = []
-        for _ in range(cpu_count()):
-            p = Process(target=self._worker,
-                        args=(chunk_queue, self.done_counter, self.completed_indexes))
-            p.start()
-            processes.append(p)
-
-        self._update_progress()
+        self._render_stopped = threading.Event()
+        updater = threading.Thread(target=self._update_progress)
+        updater.start()
+        try:
+            if self.is_stream:
+                self._stream_video(self._render_frames(pool))
+            else:
+                self._collect_frames(self._render_frames(pool))
+        finally:
+            self._render_stopped.set()
+            updater.join()
         self.progress["encode"][0]["is_encode"] = True
         write_progress_json(self.temp_dir, self.progress)
 
-        self._composite_video()
+        if not self.is_stream:
+            self._composite_video()
         self.progress["encode"][1]["is_composite_video"] = True
         write_progress_json(self.temp_dir, self.progress)
 
@@ -0,0 +1,175 @@
+import numpy as np
+
+# GF(256) 运算表，本原多项式 x^8 + x^4 + x^3 + x^2 + 1
+_EXP = np.zeros(512, dtype=np.uint8)
+_LOG = np.zeros(256, dtype=np.int32)
+_x = 1
+for _i in range(255):
+    _EXP[_i] = _x
+    _LOG[_x] = _i
+    _x <<= 1
+    if _x & 0x100:
+        _x ^= 0x11d
+_EXP[255:510] = _EXP[:255]
+
+# 完整乘法表，_MUL[a][v] 一次查表即可对整帧向量做常数乘法
+_MUL = np.zeros((256, 256), dtype=np.uint8)
+_MUL[1:, 1:] = _EXP[(_LOG[1:, None] + _LOG[None, 1:]) % 255]
+
+
+def _inv(a):
+    return int(_EXP[255 - _LOG[a]])
+
+
+def _invert_matrix(matrix):
+    """
+    GF(256) 上的高斯消元求逆，矩阵很小（不超过校验帧数）。
+    """
+    n = len(matrix)
+    rows = [list(row) + [1 if i == j else 0 for j in range(n)] for i, row in enumerate(matrix)]
+    for col in range(n):
+        pivot = next(r for r in range(col, n) if rows[r][col])
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+        scale = _inv(rows[col][col])
+        rows[col] = [int(_MUL[scale][v]) for v in rows[col]]
+        for r in range(n):
+            if r != col and rows[r][col]:
+                factor = rows[r][col]
+                rows[r] = [v ^ int(_MUL[factor][p]) for v, p in zip(rows[r], rows[col])]
+    return [row[n:] for row in rows]
+
+
+class ErasureCoder:
+    """
+    系统 Cauchy Reed-Solomon 纠删码：data 个数据分片生成 parity 个校验分片，
+    任意丢失不超过 parity 个分片都能恢复。分片是等长的 uint8 数组。
+    """
+
+    def __init__(self, data, parity):
+        if data + parity > 256:
+            raise ValueError("data + parity must not exceed 256")
+        self.data = data
+        self.parity = parity
+        # Cauchy 矩阵 C[i][j] = 1 / (x_i + y_j)，x_i = data + i，y_j = j
+        self.matrix = [[_inv((data + i) ^ j) for j in range(data)] for i in range(parity)]
+
+    def encode(self, shards):
+        parity = np.zeros((self.parity, shards.shape[1]), dtype=np.uint8)
+        for i in range(self.parity):
+            for j in range(self.data):
+                parity[i] ^= _MUL[self.matrix[i][j]][shards[j]]
+        return parity
+
+    def reconstruct(self, shards):
+        """
+        :param shards: 长度 data + parity 的列表，丢失的分片为 None
+        :return: 全部 data 个数据分片；丢失过多时抛出 ValueError
+        """
+        missing = [j for j in range(self.data) if shards[j] is None]
+        if not missing:
+            return shards[:self.data]
+
+        rows = [i for i in range(self.parity) if shards[self.data + i] is not None][:len(missing)]
+        if len(rows) < len(missing):
+            raise ValueError(f"{len(missing)} shards lost, only {len(rows)} parity shards available")
+
+        # 校验行减去已知数据分片的贡献，剩下的就是关于丢失分片的线性方程组
+        syndromes = []
+        for i in rows:
+            value = shards[self.data + i].copy()
+            for j in range(self.data):
+                if shards[j] is not None:
+                    value ^= _MUL[self.matrix[i][j]][shards[j]]
+            syndromes.append(value)
+
+        inverse = _invert_matrix([[self.matrix[i][j] for j in missing] for i in rows])
+        result = list(shards[:self.data])
+        for c, j in enumerate(missing):
+            value = np.zeros_like(syndromes[0])
+            for r in range(len(rows)):
+                value ^= _MUL[inverse[c][r]][syndromes[r]]
+            result[j] = value
+        return result
+
+
+class FrameFEC:
+    """
+    以帧为分片的跨帧纠删码布局。
+
+    数据流为 8 字节原始长度 + 内容，按 data * interleave 帧分成块（末块补零到 interleave 帧的整数倍）；
+    块内第 k 个数据帧属于第 k % interleave 组，每组生成 parity 个校验帧，
+    紧跟在块的数据帧之后（第 m * interleave + d 个校验帧属于第 d 组）。
+    交织使连续丢失至多 parity * interleave 帧仍可恢复；末块不足 data 的组缺位按全零处理。
+    """
+
+    def __init__(self, data, parity, interleave):
+        self.coder = ErasureCoder(data, parity)
+        self.data = data
+        self.parity = parity
+        self.interleave = interleave
+
+    def _block_parity(self, frames):
+        """
+        :param frames: (块内数据帧数, 帧长) 数组
+        :return: 按输出顺序排列的校验帧数组
+        """
+        length = frames.shape[1]
+        out = np.empty((self.parity * self.interleave, length), dtype=np.uint8)
+        for d in range(self.interleave):
+            group = np.zeros((self.data, length), dtype=np.uint8)
+            members = frames[d::self.interleave]
+            group[:len(members)] = members
+            out[d::self.interleave] = self.coder.encode(group)
+        return out
+
+    def encode_stream(self, src, dst, size, frame_bytes):
+        """
+        从 src 读取 size 字节，写出带校验帧的数据流，内存占用为一个块。
+        """
+        block_bytes = self.data * self.interleave * frame_bytes
+        pending = size.to_bytes(8, "big")
+        remaining = size
+        while pending or remaining:
+            read = src.read(min(block_bytes - len(pending), remaining))
+            remaining -= len(read)
+            block = pending + read
+            pending = b""
+            # 末块补零到 interleave 帧的整数倍，保证校验帧与各组的交织位置对齐
+            block += bytes(-len(block) % (frame_bytes * self.interleave))
+
+            frames = np.frombuffer(block, dtype=np.uint8).reshape(-1, frame_bytes)
+            dst.write(block)
+            dst.write(self._block_parity(frames).tobytes())
+
+    def decode_stream(self, read_frame, total_frames, frame_bytes, dst):
+        """
+        逐块重建丢失的帧并把原始数据写入 dst，内存占用为一个块。
+
+        :param read_frame: read_frame(帧序号) 返回完整的帧数据，缺失或损坏的帧返回 None
+        :param total_frames: 视频总帧数，用于推算分块布局
+        """
+        block_frames = (self.data + self.parity) * self.interleave
+        zero = np.zeros(frame_bytes, dtype=np.uint8)
+
+        def shard(index):
+            data = read_frame(index)
+            return None if data is None else np.frombuffer(data, dtype=np.uint8)
+
+        remaining = None
+        for base in range(0, total_frames, block_frames):
+            count = min(block_frames, total_frames - base) - self.parity * self.interleave
+            block = [None] * count
+            for d in range(self.interleave):
+                members = list(range(d, count, self.interleave))
+                shards = [shard(base + k) for k in members]
+                shards += [zero] * (self.data - len(shards))
+                shards += [shard(base + count + m * self.interleave + d) for m in range(self.parity)]
+                for k, value in zip(members, self.coder.reconstruct(shards)):
+                    block[k] = value
+
+            data = b"".join(value.tobytes() for value in block)
+            if remaining is None:
+                remaining = int.from_bytes(data[:8], "big")
+                data = data[8:]
+            dst.write(data[:remaining])
+            remaining -= min(remaining, len(data))
@@ -0,0 +1,61 @@
+import struct
+import zlib
+from collections import namedtuple
+
+# 每个分块负载前的帧头：标识和版本、流 id、分块序号、分块总数、流参数、CRC32（覆盖前面所有字段和数据）
+MAGIC = b"PXC"
+VERSION = 1
+_HEADER = struct.Struct(">3sBIIIBBBBBB")
+_CRC = struct.Struct(">I")
+SIZE = _HEADER.size + _CRC.size
+
+# 流参数：跨帧纠删码的数据帧数、校验帧数（0 表示没有纠删码）、交织路数，每帧码的行列数，
+# 以及压缩方法号（compress.METHODS，0 表示未压缩）。
+# 解码端按视频里记录的参数恢复，不依赖本地设置与编码端一致
+StreamParams = namedtuple("StreamParams", ["fec_data", "fec_parity", "fec_interleave", "rows", "cols",
+                                           "compression"])
+
+# 加入帧头之前的旧视频：每帧一个码、负载就是文件内容，按帧序排列，没有纠删码
+LEGACY_STREAM = -1
+LEGACY_PARAMS = StreamParams(0, 0, 0, 1, 1, 0)
+
+
+def stream_id(task_id):
+    return zlib.crc32(str(task_id).encode("utf-8"))
+
+
+def pack(stream, index, total, params, data):
+    head = _HEADER.pack(MAGIC, VERSION, stream, index, total, *params)
+    crc = zlib.crc32(data, zlib.crc32(head))
+    return head + _CRC.pack(crc) + bytes(data)
+
+
+def is_framed(payload):
+    """
+    负载是否以帧头开始；不是的按旧视频处理。
+    """
+    return bytes(payload[:len(MAGIC)]) == MAGIC
+
+
+def unpack(payload):
+    """
+    :return: (流 id, 分块序号, 分块总数, 流参数, 数据)；长度不足、版本不认识或校验失败返回 None
+    """
+    if len(payload) < SIZE:
+        return None
+    head = payload[:_HEADER.size]
+    crc, = _CRC.unpack_from(payload, _HEADER.size)
+    data = payload[SIZE:]
+    if zlib.crc32(data, zlib.crc32(head)) != crc:
+        return None
+    magic, version, stream, index, total, *params = _HEADER.unpack(head)
+    if magic != MAGIC or version != VERSION or index >= total:
+        return None
+    return stream, index, total, StreamParams(*params), bytes(data)
+
+
+def legacy(payload):
+    """
+    旧视频的负载，分块序号由解码端按帧序给出。
+    """
+    return LEGACY_STREAM, None, None, LEGACY_PARAMS, bytes(payload)
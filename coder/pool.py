@@ -0,0 +1,92 @@
+import threading
+from collections import deque
+from multiprocessing import TimeoutError, cpu_count, get_context
+
+# 工作进程内的对象缓存（栅格化缓冲区、块编码器等），跨批次、跨任务复用
+_worker_cache = {}
+
+
+def cached(key, factory):
+    if key not in _worker_cache:
+        _worker_cache[key] = factory()
+    return _worker_cache[key]
+
+
+class CoderPool:
+    """
+    编码/解码共用的常驻进程池。
+
+    由 BiliPan 持有，多个并发任务共享同一组工作进程；工作项按 batch_size 分批提交，
+    每个任务同时在途的批次数有上限，结果按提交顺序返回。
+    close() 之后不再接受新任务，仍在等待结果的任务抛出 RuntimeError。
+    """
+
+    def __init__(self, processes=None, batch_size=8):
+        self.processes = processes or cpu_count()
+        self.batch_size = batch_size
+        self._pool = None
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("CoderPool is closed")
+            if self._pool is None:
+                # 用 spawn 启动：fork 出的工作进程会继承其它任务已打开的 ffmpeg stdin 管道，
+                # 导致 ffmpeg 永远等不到 EOF；Windows 上本来就是 spawn
+                self._pool = get_context("spawn").Pool(self.processes)
+            return self._pool
+
+    def _batches(self, items, batch_size):
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def map_batches(self, func, job, items, max_inflight=None, batch_size=None):
+        """
+        对 items 逐批调用 func(job, batch)（返回结果列表），按顺序逐项产出结果。
+
+        :param max_inflight: 最多同时在途的工作项数，默认每个工作进程两批
+        :param batch_size: 每批工作项数，默认使用进程池的 batch_size
+        """
+        batch_size = batch_size or self.batch_size
+        if max_inflight is None:
+            max_batches = self.processes * 2
+        else:
+            max_batches = max(1, max_inflight // batch_size)
+
+        pool = self._get_pool()
+        pending = deque()
+        for batch in self._batches(items, batch_size):
+            pending.append(pool.apply_async(func, (job, batch)))
+            if len(pending) >= max_batches:
+                yield from self._get(pending.popleft())
+
+        while pending:
+            yield from self._get(pending.popleft())
+
+    def _get(self, result):
+        # 进程池被终止后未完成的结果永远不会返回，定时检查是否已关闭
+        while True:
+            try:
+                return result.get(0.1)
+            except TimeoutError:
+                if self._closed:
+                    raise RuntimeError("CoderPool is closed")
+
+    def close(self):
+        """
+        直接终止工作进程，不等排队的工作做完，窗口关闭时不会卡住。
+        """
+        with self._lock:
+            self._closed = True
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool.join()
+                self._pool = None
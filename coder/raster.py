@@ -0,0 +1,57 @@
+import numpy as np
+
+
+class QRRasterizer:
+    """
+    把 QR 模块矩阵（qr.modules）直接放大为 uint8 灰度帧。
+
+    单码时输出与 qrcode 的 make_image(fill_color="black", back_color="white") 逐字节一致；
+    grid 为 (行, 列) 时按行优先把多个码平铺到同一帧，每个码居中放在等大的格子里，
+    格子之间留 gap 个模块宽的空白。输出缓冲区按尺寸复用，每个工作进程各持有一个实例即可。
+    """
+
+    def __init__(self, box_size, border, grid=(1, 1), gap=0):
+        self.box_size = box_size
+        self.border = border
+        self.rows, self.cols = grid
+        self.gap = gap if self.rows * self.cols > 1 else 0
+        self._buffer = None
+
+    def tile_size(self, modules_count):
+        return (modules_count + self.border * 2) * self.box_size
+
+    def cell_size(self, modules_count):
+        return self.tile_size(modules_count) + self.gap * self.box_size
+
+    def frame_size(self, modules_count):
+        cell = self.cell_size(modules_count)
+        return self.cols * cell, self.rows * cell
+
+    def _get_buffer(self, modules_count):
+        width, height = self.frame_size(modules_count)
+        if self._buffer is None or self._buffer.shape != (height, width):
+            self._buffer = np.full((height, width), 255, dtype=np.uint8)
+        return self._buffer
+
+    def render(self, modules):
+        return self.render_tiles([modules])
+
+    def render_tiles(self, modules_list):
+        matrices = [np.asarray(modules, dtype=bool) for modules in modules_list]
+        count = matrices[0].shape[0]
+        frame = self._get_buffer(count)
+        if len(matrices) < self.rows * self.cols:
+            # 末帧不满时清掉上一帧残留的码
+            frame.fill(255)
+
+        cell = self.cell_size(count)
+        offset = self.gap * self.box_size // 2 + self.border * self.box_size
+        side = count * self.box_size
+        for i, matrix in enumerate(matrices):
+            row, col = divmod(i, self.cols)
+            top = row * cell + offset
+            left = col * cell + offset
+            # 码区域视作 (行模块, 行像素, 列模块, 列像素)，一次广播赋值完成放大
+            inner = frame[top:top + side, left:left + side].reshape(count, self.box_size, count, self.box_size)
+            inner[...] = np.where(matrix, 0, 255).astype(np.uint8)[:, None, :, None]
+        return frame
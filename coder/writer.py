@@ -0,0 +1,108 @@
+from tool.progress_json import ProgressBitmap
+
+
+class ChunkWriter:
+    """
+    解码出的分块按序号直接写入预分配文件的 index * chunk_size 处，内存占用与文件大小无关。
+
+    除末块外所有分块等长，块长取自第一个非末块；在此之前收到的末块先暂存。
+    没有帧头的旧视频用 write_unframed 写入，总数事先未知。
+    """
+
+    def __init__(self, path, state=None):
+        """
+        :param state: 中断前 state() 的返回值，给出时在已有文件上接着写
+        """
+        self.path = path
+        self._pending = {}
+        if state is None:
+            self.file = open(path, "wb+")
+            self.chunk_size = None
+            self.total = 0
+            self.present = ProgressBitmap()
+            self._last_size = None
+            self.unframed = False
+        else:
+            self.file = open(path, "rb+")
+            self.chunk_size = state["chunk_size"]
+            self.total = state["total"]
+            self.present = ProgressBitmap.loads(state["present"])
+            self._last_size = state["last_size"]
+            self.unframed = state.get("unframed", False)
+
+    def write(self, index, total, data):
+        if index in self.present:
+            return
+        self.total = total
+
+        if self.chunk_size is None:
+            if index == total - 1 and total > 1:
+                self._pending[index] = data
+                return
+            self._allocate(len(data))
+        self._put(index, data)
+
+    def write_unframed(self, index, data):
+        """
+        旧视频一帧一块：块长取第一个收到的分块（按帧序解码时就是第一帧），
+        总数按收到的最大序号推算，序号最大的那块是末块。
+        """
+        if index in self.present:
+            return
+        self.unframed = True
+        if self.chunk_size is None:
+            self.chunk_size = len(data)
+        self.total = max(self.total, index + 1)
+        self._put(index, data)
+
+    def _allocate(self, chunk_size):
+        self.chunk_size = chunk_size
+        self.file.truncate(self.total * chunk_size)
+        for index, data in self._pending.items():
+            self._put(index, data)
+        self._pending.clear()
+
+    def _put(self, index, data):
+        self.file.seek(index * self.chunk_size)
+        self.file.write(data)
+        self.present.add(index)
+        if index == self.total - 1:
+            self._last_size = len(data)
+
+    def has(self, index):
+        return index in self.present
+
+    @property
+    def complete(self):
+        # 旧视频的总数只是目前见过的帧数，不能据此提前结束
+        return not self.unframed and self.total > 0 and self.present.count == self.total
+
+    def state(self):
+        """
+        可恢复的写入状态；块长未定时末块还只在内存里，返回 None。
+        先取位图再刷盘，保证位图里的分块都已写入文件。
+        """
+        if self.chunk_size is None:
+            return None
+        state = {"chunk_size": self.chunk_size, "total": self.total, "last_size": self._last_size,
+                 "unframed": self.unframed, "present": self.present.dumps()}
+        self.file.flush()
+        return state
+
+    def finish(self):
+        """
+        截掉末块补出来的空间；只收到末块时以它的长度为块长。
+        """
+        if self.chunk_size is None:
+            if not self._pending:
+                return
+            self._allocate(len(next(iter(self._pending.values()))))
+
+        size = self.total * self.chunk_size
+        if self._last_size is not None:
+            size -= self.chunk_size - self._last_size
+        self.file.truncate(size)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,36 @@
+from ctypes import cast, c_void_p
+
+from pyzbar.pyzbar import ZBarSymbol, _FOURCC, _decode_symbols, _image, _image_scanner, _pixel_data, _symbols_for_image
+from pyzbar.pyzbar_error import PyZbarError
+from pyzbar.wrapper import (
+    zbar_image_scanner_set_config, zbar_image_set_data, zbar_image_set_format, zbar_image_set_size,
+    zbar_scan_image, ZBarConfig
+)
+
+# zbar >= 0.23 的 ZBAR_CFG_BINARY，pyzbar 的 ZBarConfig 中没有这一项
+ZBAR_CFG_BINARY = 4
+
+
+def decode_binary(image):
+    """
+    与 pyzbar.decode 相同，但只识别 QR 码并打开 zbar 的二进制模式，
+    字节模式的数据原样返回，不做字符集猜测和 UTF-8 转换。
+    """
+    pixels, width, height = _pixel_data(image)
+
+    results = []
+    with _image_scanner() as scanner:
+        zbar_image_scanner_set_config(scanner, ZBarSymbol.NONE, ZBarConfig.CFG_ENABLE, 0)
+        zbar_image_scanner_set_config(scanner, ZBarSymbol.QRCODE, ZBarConfig.CFG_ENABLE, 1)
+        zbar_image_scanner_set_config(scanner, ZBarSymbol.QRCODE, ZBAR_CFG_BINARY, 1)
+        with _image() as img:
+            zbar_image_set_format(img, _FOURCC['L800'])
+            zbar_image_set_size(img, width, height)
+            zbar_image_set_data(img, cast(pixels, c_void_p), len(pixels), None)
+            decoded = zbar_scan_image(scanner, img)
+            if decoded < 0:
+                raise PyZbarError('Unsupported image format')
+            else:
+                results.extend(_decode_symbols(_symbols_for_image(img)))
+
+    return results
@@ -2,6 +2,7 @@ from http.cookiejar import LWPCookieJar
 from typing import Dict, Optional, Union
 
 import requests
+from requests.adapters import HTTPAdapter
 from fake_useragent import UserAgent
 
 
@@ -23,9 +24,17 @@ class ApiRequest:
         self.session.cookies = LWPCookieJar(filename=cookie_file)
         self.session.cookies.load(ignore_discard=True)
 
-    def get_response(self, method: str, url: str, params: Optional[Dict] = None, data: Optional[Union[Dict, bytes, list]] = None, is_json: bool = False, headers=None, session=None):
+    def set_pool_size(self, size: int):
         """
-        通用 API 请求方法。
+        按并发数设置连接池大小，多个线程同时请求同一主机时复用长连接而不是反复建连。
+        """
+        adapter = HTTPAdapter(pool_connections=size, pool_maxsize=size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def get_response(self, method: str, url: str, params: Optional[Dict] = None, data: Optional[Union[Dict, bytes, list]] = None, is_json: bool = False, headers=None, session=None, raw: bool = False, timeout=None):
+        """
+        通用 API 请求方法。可在多个线程中并发调用。
 
         :param method: HTTP 方法（GET/POST/PUT）
         :param url: 请求 URL
@@ -34,6 +43,8 @@ class ApiRequest:
         :param headers: 自定义请求头
         :param is_json: 是否发送 JSON 数据
         :param session: 自定义对话
+        :param raw: 是否直接返回响应对象（需要读取响应头时使用）
+        :param timeout: 连接和读取的超时秒数，默认不超时
         :return: 响应字典
         """
 
@@ -48,19 +59,23 @@ class ApiRequest:
             self.session = session
 
         if method.upper() == 'GET':
-            self.response = self.session.get(url, params=params, headers=headers)
+            response = self.session.get(url, params=params, headers=headers, timeout=timeout)
         elif method.upper() == 'POST':
             if is_json:
-                self.response = self.session.post(url, json=data, params=params, headers=headers)
+                response = self.session.post(url, json=data, params=params, headers=headers, timeout=timeout)
             else:
-                self.response = self.session.post(url, data=data, params=params, headers=headers)
+                response = self.session.post(url, data=data, params=params, headers=headers, timeout=timeout)
         elif method.upper() == 'PUT':
-            self.response = self.session.put(url, data=data, params=params, headers=headers)
+            response = self.session.put(url, data=data, params=params, headers=headers, timeout=timeout)
+        # 并发调用时各线程只使用自己的局部变量，self.response 仅保留最近一次响应
+        self.response = response
 
-        self.response.raise_for_status()
+        response.raise_for_status()
+        if raw:
+            return response
 
         try:
-            return self.response.json()
+            return response.json()
         except requests.exceptions.JSONDecodeError:
-            self.response.encoding = "utf-8"
-            return self.response
+            response.encoding = "utf-8"
+            return response
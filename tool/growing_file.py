@@ -0,0 +1,36 @@
+import os
+import threading
+
+
+class GrowingFile:
+    """
+    另一个线程正在顺序写入的文件。读取方等待所需的字节写出，写入方结束时调用 finish 或 fail。
+    只适用于只追加、不回写的文件（如分片 MP4），已写出的字节不会再变。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.size = None
+        self.error = None
+        self._done = threading.Event()
+
+    def finish(self):
+        self.size = os.path.getsize(self.path)
+        self._done.set()
+
+    def fail(self, error):
+        self.error = error
+        self._done.set()
+
+    def wait(self, size):
+        """
+        等到文件至少有 size 字节或写入结束。写入结束后 self.size 为最终大小。
+        """
+        while True:
+            if self._done.is_set():
+                if self.error is not None:
+                    raise RuntimeError(f"Writing {self.path} failed") from self.error
+                return
+            if os.path.exists(self.path) and os.path.getsize(self.path) >= size:
+                return
+            self._done.wait(0.1)
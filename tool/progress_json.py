@@ -1,5 +1,10 @@
+import base64
 import json
 import os
+import threading
+
+# 编码和上传线程可能同时保存同一份进度
+_write_lock = threading.Lock()
 
 
 def init_progress_json(temp, mode):
@@ -8,14 +13,14 @@ def init_progress_json(temp, mode):
         if mode == "u":
             progress = {
                 "encode": [
-                    {"is_encode": False, "percent": 0, "completed_chucks_indexes": []},
+                    {"is_encode": False, "percent": 0, "completed_chucks_bitmap": ""},
                     {"is_composite_video": False}
                 ],
                 "upload": [
                     {"is_upload_cover": False},
                     {"is_preupload_video": False},
                     {"is_init_upload_session": False},
-                    {"is_upload_chunks": False},
+                    {"is_upload_chunks": False, "completed_chucks_bitmap": "", "etags": {}},
                     {"is_complete_upload": False},
                     {"is_submit_video": False}
                 ],
@@ -23,7 +28,7 @@ def init_progress_json(temp, mode):
         elif mode == "d":
             progress = {
                 "decode": [
-                    {"is_decode": False, "percent": 0, "completed_chucks_indexes": []},
+                    {"is_decode": False, "percent": 0, "completed_chucks_bitmap": ""},
                     {"is_wirte_file": False}
                 ],
                 "download": [
@@ -42,5 +47,46 @@ def read_progress_json(temp):
         return json.loads(f.read())
 
 def write_progress_json(temp, progress):
-    with open(f"{temp}/progress.json", "w") as f:
-        json.dump(progress, f)
+    # 一次性序列化（json.dump 边遍历边写文件，期间其它线程修改进度会出错）；
+    # 先写临时文件再整体替换，写到一半崩溃也不会留下不完整的 progress.json
+    with _write_lock:
+        text = json.dumps(progress)
+        with open(f"{temp}/progress.json.tmp", "w") as f:
+            f.write(text)
+        os.replace(f"{temp}/progress.json.tmp", f"{temp}/progress.json")
+
+
+class ProgressBitmap:
+    """
+    已完成序号的位图：置位、查询和计数都是 O(1)，
+    写入 progress.json 时整体编码为 base64 字符串，不再逐项复制序号列表。
+    """
+
+    def __init__(self, size=0):
+        self.bits = bytearray((size + 7) // 8)
+        self.count = 0
+
+    def add(self, index):
+        byte, bit = divmod(index, 8)
+        if byte >= len(self.bits):
+            self.bits.extend(bytes(byte + 1 - len(self.bits)))
+        if not self.bits[byte] >> bit & 1:
+            self.bits[byte] |= 1 << bit
+            self.count += 1
+
+    def __contains__(self, index):
+        byte, bit = divmod(index, 8)
+        return byte < len(self.bits) and bool(self.bits[byte] >> bit & 1)
+
+    def dumps(self):
+        return base64.b64encode(bytes(self.bits)).decode("ascii")
+
+    @classmethod
+    def loads(cls, text):
+        """
+        从 dumps() 的结果恢复，用于中断后继续任务。
+        """
+        bitmap = cls()
+        bitmap.bits = bytearray(base64.b64decode(text))
+        bitmap.count = sum(bin(byte).count("1") for byte in bitmap.bits)
+        return bitmap
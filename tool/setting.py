@@ -4,6 +4,11 @@ from typing import Dict
 
 import qrcode
 
+# 块编码默认参数：1920x1080 画面，6 像素方块，每块 2 bit
+DEFAULT_BLOCK_SETTING = {"block_size": 6, "cols": 320, "rows": 180, "bits_per_block": 2, "rs_nsym": 32}
+# 跨帧纠删码默认参数：每 20 个数据帧 2 个校验帧（10% 冗余），4 路交织；parity 为 0 时关闭
+DEFAULT_FEC_SETTING = {"data": 20, "parity": 2, "interleave": 4}
+
 
 class Setting:
     def __init__(self):
@@ -19,7 +24,33 @@ class Setting:
                                            "error_correction": qrcode.constants.ERROR_CORRECT_L,
                                            "chuck_size": 1024,
                                            "qr_version": 20,
-                                           "fps": 5},
+                                           "fps": 5,
+                                           "composite_mode": "stream",
+                                           "inflight_frames": 64,
+                                           "payload_format": "binary",
+                                           "grid": [1, 1],
+                                           "tile_gap": 4,
+                                           "codec": "qr",
+                                           "block": DEFAULT_BLOCK_SETTING,
+                                           "compression": "auto",
+                                           "compress_block": 4 * 1024 * 1024,
+                                           "fec": DEFAULT_FEC_SETTING,
+                                           "fragmented": True},
+                                 "decode": {"codec": "qr",
+                                            "block": DEFAULT_BLOCK_SETTING,
+                                            "extract_mode": "segment",
+                                            "ring_slots": 32,
+                                            "segment_seconds": 30,
+                                            "dedupe_threshold": 24,
+                                            "roi": True,
+                                            "backend": "auto",
+                                            "pipelined": True,
+                                            "shard_parallel": 2},
+                                 "pool": {"processes": 0, "batch_size": 8},
+                                 "upload": {"concurrency": 4, "pipelined": True, "retries": 5, "backoff": 1.0,
+                                            "timeout": 60, "max_duration": 10 * 3600,
+                                            "max_video_size": 8 * 1024 * 1024 * 1024, "video_expansion": 25,
+                                            "shard_parallel": 2},
                                  "aria2": {"sever_port": None}}
                 json.dump(self.set_json, f)
                 self.read_json()
@@ -58,6 +89,17 @@ class Setting:
         chuck_size = self.set_json["encode"]["chuck_size"]
         fps = self.set_json["encode"]["fps"]
         qr_version = self.set_json["encode"]["qr_version"]
+        composite_mode = self.set_json["encode"].get("composite_mode", "stream")
+        inflight_frames = self.set_json["encode"].get("inflight_frames", 64)
+        payload_format = self.set_json["encode"].get("payload_format", "binary")
+        grid = self.set_json["encode"].get("grid", [1, 1])
+        tile_gap = self.set_json["encode"].get("tile_gap", 4)
+        codec = self.set_json["encode"].get("codec", "qr")
+        block = {**DEFAULT_BLOCK_SETTING, **self.set_json["encode"].get("block", {})}
+        compression = self.set_json["encode"].get("compression", "auto")
+        compress_block = self.set_json["encode"].get("compress_block", 4 * 1024 * 1024)
+        fec = {**DEFAULT_FEC_SETTING, **self.set_json["encode"].get("fec", {})}
+        fragmented = self.set_json["encode"].get("fragmented", True)
         return \
         {
             "box_size": box_size,
@@ -65,5 +107,78 @@ class Setting:
             "error_correction": error_correction,
             "chuck_size": chuck_size,
             "qr_version": qr_version,
-            "fps": fps
+            "fps": fps,
+            "composite_mode": composite_mode,
+            "inflight_frames": inflight_frames,
+            "payload_format": payload_format,
+            "grid": grid,
+            "tile_gap": tile_gap,
+            "codec": codec,
+            "block": block,
+            "compression": compression,
+            "compress_block": compress_block,
+            "fec": fec,
+            "fragmented": fragmented
+        }
+
+    def read_pool_setting(self) -> Dict:
+        pool = self.set_json.get("pool", {})
+        processes = pool.get("processes", 0)
+        batch_size = pool.get("batch_size", 8)
+        return \
+        {
+            "processes": processes,
+            "batch_size": batch_size
+        }
+
+    def read_upload_setting(self) -> Dict:
+        upload = self.set_json.get("upload", {})
+        concurrency = upload.get("concurrency", 4)
+        pipelined = upload.get("pipelined", True)
+        retries = upload.get("retries", 5)
+        backoff = upload.get("backoff", 1.0)
+        timeout = upload.get("timeout", 60)
+        # 平台单个视频的时长（秒）和文件大小上限，超出时输入分成多个视频上传，都为 0 表示不分片；
+        # video_expansion 是编码出的视频与负载的大小之比，用于估算视频大小
+        max_duration = upload.get("max_duration", 10 * 3600)
+        max_video_size = upload.get("max_video_size", 8 * 1024 * 1024 * 1024)
+        video_expansion = upload.get("video_expansion", 25)
+        shard_parallel = upload.get("shard_parallel", 2)
+        return \
+        {
+            "concurrency": max(1, concurrency),
+            "pipelined": pipelined,
+            "retries": retries,
+            "backoff": backoff,
+            "timeout": timeout,
+            "max_duration": max_duration,
+            "max_video_size": max_video_size,
+            "video_expansion": video_expansion,
+            "shard_parallel": max(1, shard_parallel)
+        }
+
+    def read_decoder_setting(self) -> Dict:
+        decode_setting = self.set_json.get("decode", {})
+        codec = decode_setting.get("codec", "qr")
+        block = {**DEFAULT_BLOCK_SETTING, **decode_setting.get("block", {})}
+        extract_mode = decode_setting.get("extract_mode", "segment")
+        ring_slots = decode_setting.get("ring_slots", 32)
+        segment_seconds = decode_setting.get("segment_seconds", 30)
+        dedupe_threshold = decode_setting.get("dedupe_threshold", 24)
+        roi = decode_setting.get("roi", True)
+        backend = decode_setting.get("backend", "auto")
+        pipelined = decode_setting.get("pipelined", True)
+        shard_parallel = decode_setting.get("shard_parallel", 2)
+        return \
+        {
+            "codec": codec,
+            "block": block,
+            "extract_mode": extract_mode,
+            "ring_slots": ring_slots,
+            "segment_seconds": segment_seconds,
+            "dedupe_threshold": dedupe_threshold,
+            "roi": roi,
+            "backend": backend,
+            "pipelined": pipelined,
+            "shard_parallel": max(1, shard_parallel)
         }
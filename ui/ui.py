@@ -423,6 +423,8 @@ class PanPage(QFrame):
         super().__init__(parent)
         self.setObjectName("my-pan".replace(' ', '-'))
         self.bili_pan = biliPan.BiliPan(setting)
+        # 继续上次退出或崩溃时未完成的上传/下载任务
+        self.bili_pan.resume_tasks()
         self.uplaod_page = uplaod_page
         self.download_page = download_page
         self.init_ui()
@@ -521,3 +523,8 @@ class Window(FluentWindow):
         self.user_item.setText(data["uname"])
         self.user_item.setIcon(data["face"])
 
+    def closeEvent(self, event):
+        self.pan_interface.bili_pan.close()
+        self.upload_interface.pan_background.close()
+        super().closeEvent(event)
+